@@ -0,0 +1,269 @@
+import multiprocessing
+import os
+import resource
+import time
+from argparse import ArgumentParser
+from typing import *
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from datamodules import *
+from datamodules.folder import decode_image, find_images
+from datamodules.LMDB import LMDBDataset
+from models import *
+from transforms import *
+
+
+def hyperparameters():
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ## per-image transform cost
+    transforms = subparsers.add_parser("transforms")
+    add = transforms.add_argument
+    add("--transforms", type=str, choices=list(TRANSFORMS_TABLE.keys()))
+    add("--image_channels", type=int, default=3)
+    add("--image_size", type=int, default=224)
+    add("--source_shape", type=int, nargs="+", default=[32, 32, 3])
+    add("--num_images", type=int, default=1000)
+
+    ## random access reads, source dataset vs its LMDB conversion
+    lmdb = subparsers.add_parser("lmdb")
+    add = lmdb.add_argument
+    add("--dataset", type=str, choices=list(DATAMODULE_TABLE.keys()))
+    add("--root_dir", type=str)
+    add("--lmdb_dir", type=str)
+    add("--num_samples", type=int, default=2000)
+
+    ## train loader throughput, float32 vs uint8 transport
+    loader = subparsers.add_parser("loader")
+    add = loader.add_argument
+    add("--dataset", type=str, choices=list(DATAMODULE_TABLE.keys()))
+    add("--root_dir", type=str)
+    add("--image_channels", type=int, default=3)
+    add("--image_size", type=int, default=224)
+    add("--batch_size", type=int, default=256)
+    add("--num_workers", type=int, default=4)
+    add("--num_batches", type=int, default=50)
+    add("--shared_collate", action="store_true")
+
+    ## peak memory and step time, with and without activation checkpointing
+    checkpoint = subparsers.add_parser("checkpoint")
+    add = checkpoint.add_argument
+    add("--model", type=str, choices=list(MODEL_TABLE.keys()))
+    add("--model_type", type=str)
+    add("--num_classes", type=int, default=10)
+    add("--image_channels", type=int, default=3)
+    add("--image_size", type=int, default=224)
+    add("--batch_size", type=int, default=32)
+    add("--checkpoint_segments", type=int, nargs="+", default=[2, 4])
+    add("--num_steps", type=int, default=5)
+    add("--dropout_rate", type=float, default=0.5)
+    add("--depth", type=int, default=40)
+    add("--K", type=int, default=10)
+    add("--growth_rate", type=int, default=12)
+    add("--loss_w", type=float, default=0.5)
+    add("--aux_loss_w", type=float, default=0.5)
+    add("--lr", type=float, default=0.1)
+    add("--momentum", type=float, default=0)
+    add("--weight_decay", type=float, default=0)
+
+    return parser.parse_args()
+
+
+def benchmark_transforms(args) -> Dict[str, float]:
+    """CPU time per image of the train and eval transforms"""
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, [args.num_images] + args.source_shape, np.uint8)
+    image_shape = [args.image_channels, args.image_size, args.image_size]
+
+    result = {}
+    for mode in ["train", "eval"]:
+        transforms = TRANSFORMS_TABLE[args.transforms](
+            image_shape=image_shape,
+            train=mode,
+        )
+        transforms(images[0])  # warm up
+
+        start = time.process_time()
+        for image in images:
+            transforms(image)
+        elapsed = time.process_time() - start
+        result[f"{mode}/cpu_ms_per_image"] = elapsed / len(images) * 1e3
+    return result
+
+
+def benchmark_lmdb(args) -> Dict[str, float]:
+    """Decoded samples/sec in random order, no transforms"""
+    if args.dataset == "FOLDER":
+        paths, _, _ = find_images(os.path.join(args.root_dir, "train"))
+        source = lambda i: decode_image(paths[i])
+        num_samples = len(paths)
+    else:
+        # the torchvision path the datamodules used to take
+        datamodule = DATAMODULE_TABLE[args.dataset](
+            root_dir=args.root_dir,
+            train_transforms=None,
+            val_transforms=None,
+            test_transforms=None,
+            batch_size=1,
+            num_workers=0,
+        )
+        dataset = datamodule.Dataset(args.root_dir, train=True)
+        source = dataset.__getitem__
+        num_samples = len(dataset)
+
+    lmdb_dataset = LMDBDataset(os.path.join(args.lmdb_dir, "train.lmdb"))
+    rng = np.random.default_rng(0)
+    indices = rng.permutation(num_samples)[: args.num_samples].tolist()
+
+    result = {}
+    for name, read in [("source", source), ("lmdb", lmdb_dataset.__getitem__)]:
+        start = time.perf_counter()
+        for i in indices:
+            read(i)
+        elapsed = time.perf_counter() - start
+        result[f"{name}/samples_per_sec"] = len(indices) / elapsed
+    return result
+
+
+def _children_cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def benchmark_loader(args) -> Dict[str, float]:
+    """Train batches/sec, bytes per batch and CPU time, workers and main
+
+    Workers are not persistent, their CPU time is collected when the loader
+    shuts them down, start up and prefetched batches included. Main process
+    time includes the per batch normalize of the uint8 mode
+    (`transform_batch`).
+    """
+    image_shape = [args.image_channels, args.image_size, args.image_size]
+    result = {}
+    for mode in ["float32", "uint8"]:
+        transforms = BaseTransforms(
+            image_shape=image_shape, train=True, uint8=mode == "uint8"
+        )
+        datamodule = DATAMODULE_TABLE[args.dataset](
+            root_dir=args.root_dir,
+            train_transforms=transforms,
+            val_transforms=transforms,
+            test_transforms=transforms,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            persistent_workers=False,
+            pin_memory=args.shared_collate,
+            shared_collate=args.shared_collate,
+        )
+        datamodule.setup("fit")
+
+        iterator = iter(datamodule.train_dataloader())
+        next(iterator)  # worker start up
+        workers_start = _children_cpu_time()
+        main_start = time.process_time()
+        start = time.perf_counter()
+        for _ in range(args.num_batches):
+            x, *_ = next(iterator)
+            num_bytes = x.numel() * x.element_size()
+            transforms.transform_batch(x)
+        elapsed = time.perf_counter() - start
+        main_time = time.process_time() - main_start
+        del iterator
+        workers_time = _children_cpu_time() - workers_start
+
+        result[f"{mode}/batches_per_sec"] = args.num_batches / elapsed
+        result[f"{mode}/mbytes_per_batch"] = num_bytes / 2**20
+        result[f"{mode}/main_cpu_ms_per_batch"] = main_time / args.num_batches * 1e3
+        result[f"{mode}/worker_cpu_ms_per_batch"] = (
+            workers_time / args.num_batches * 1e3
+        )
+    return result
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _train_steps(args, segments: int) -> Tuple[float, float]:
+    """(peak bytes, seconds) per train step, run in a fresh process"""
+    torch.manual_seed(0)
+    model = MODEL_TABLE[args.model](args)
+    if segments:
+        model.checkpoint_stages(segments)
+    model.train()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    x = torch.rand(
+        args.batch_size,
+        args.image_channels,
+        args.image_size,
+        args.image_size,
+        device=device,
+    )
+    y = torch.randint(args.num_classes, (args.batch_size,), device=device)
+
+    def step() -> None:
+        logit = model(x)
+        # auxiliary heads (Inception) are not part of the comparison
+        logit = logit[0] if isinstance(logit, (list, tuple)) else logit
+        F.cross_entropy(logit, y).backward()
+        model.zero_grad(set_to_none=True)
+
+    if device.type == "cuda":
+        step()  # warm up
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        # the peak RSS of the process is only known after the fact, the
+        # first step sets it; glibc keeps freed pages, so no warm up
+        base = _rss_bytes()
+
+    start = time.perf_counter()
+    for _ in range(args.num_steps):
+        step()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        # ru_maxrss is in KiB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+    return peak, (time.perf_counter() - start) / args.num_steps
+
+
+def benchmark_checkpoint(args) -> Dict[str, float]:
+    """Peak step memory and ms per train step for `--checkpoint_segments`
+
+    Every setting trains in its own process, so the peak of one does not
+    hide the next. Peak memory is the growth over the built model: CUDA
+    allocator peak, or peak RSS on CPU.
+    """
+    result = {}
+    context = multiprocessing.get_context("spawn")
+    for segments in [0, *args.checkpoint_segments]:
+        with context.Pool(1) as pool:
+            peak, seconds = pool.apply(_train_steps, (args, segments))
+        mode = f"segments_{segments}" if segments else "plain"
+        result[f"{mode}/peak_mbytes"] = peak / 2**20
+        result[f"{mode}/ms_per_step"] = seconds * 1e3
+    return result
+
+
+BENCHMARK_TABLE: Dict[str, Callable] = {
+    "transforms": benchmark_transforms,
+    "lmdb": benchmark_lmdb,
+    "loader": benchmark_loader,
+    "checkpoint": benchmark_checkpoint,
+}
+
+
+if __name__ == "__main__":
+    args = hyperparameters()
+    result = BENCHMARK_TABLE[args.benchmark](args)
+    for k, v in result.items():
+        print(f"{k}: {v:.4f}")
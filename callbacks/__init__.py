@@ -0,0 +1,12 @@
+from callbacks.batch_size import *
+from callbacks.progressive import *
+
+__all__ = [
+    # progressive resizing
+    "ProgressiveResize",
+    "parse_schedule",
+    # memory budgeted batch size
+    "probe_batch_size",
+    "plan_batch_size",
+    "auto_batch_size",
+]
@@ -0,0 +1,253 @@
+from typing import *
+import json
+import math
+import os
+
+import torch
+import torch.nn as nn
+from pytorch_lightning.utilities import rank_zero_info
+
+from models.LitBase.checkpointing import CheckpointedSequential
+
+__all__ = ["probe_batch_size", "plan_batch_size", "auto_batch_size"]
+
+
+def _outputs(output: Any) -> List[torch.Tensor]:
+    # models with auxiliary heads return [logit, aux] while training
+    if isinstance(output, torch.Tensor):
+        return [output]
+    return [o for o in output if isinstance(o, torch.Tensor)]
+
+
+def _parameter_bytes(model: nn.Module) -> int:
+    # weights and their gradients, optimizer state not included
+    return 2 * sum(p.numel() * p.element_size() for p in model.parameters())
+
+
+def _stages(model: nn.Module) -> List[CheckpointedSequential]:
+    return [m for m in model.modules() if isinstance(m, CheckpointedSequential)]
+
+
+def _saved_bytes(model: nn.Module, x: torch.Tensor) -> float:
+    """Tensors kept for backward by a forward on `x`, checkpointing included
+
+    The forward runs without checkpointing, every saved tensor is charged
+    to the checkpoint segment it was saved in, or to the model when outside
+    of all of them. A checkpointed step keeps the latter plus the segment
+    inputs, and holds one segment's tensors at a time when recomputing
+    them in backward: the largest segment counts once. Backward
+    gradients are charged as two of the largest saved tensors.
+    """
+    saved = {None: {}}  # segment -> {(data_ptr, numel): bytes}
+    current = [None]
+    # weights saved by the ops are counted by `_parameter_bytes`
+    weights = {p.data_ptr() for p in model.parameters()}
+
+    def add(segment: Any, tensor: torch.Tensor) -> None:
+        if tensor.data_ptr() in weights:
+            return
+        key = (tensor.data_ptr(), tensor.numel())
+        saved.setdefault(segment, {})[key] = tensor.numel() * tensor.element_size()
+
+    def pack(tensor: torch.Tensor) -> torch.Tensor:
+        # a tensor saved by several ops is counted once
+        add(current[0], tensor)
+        return tensor
+
+    def enter(segment: Any) -> Callable:
+        def hook(module: nn.Module, inputs: Tuple[torch.Tensor]) -> None:
+            add(None, inputs[0])  # kept by the checkpoint
+            current[0] = segment
+
+        return hook
+
+    def leave(*args) -> None:
+        current[0] = None
+
+    handles, stages = [], _stages(model)
+    segments = [stage.segments for stage in stages]
+    for stage in stages:
+        for i, run in enumerate(stage.runs()):
+            handles.append(run[0].register_forward_pre_hook(enter((id(stage), i))))
+            handles.append(run[-1].register_forward_hook(leave))
+        stage.segments = 0
+    try:
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            _outputs(model(x))
+    finally:
+        for handle in handles:
+            handle.remove()
+        for stage, count in zip(stages, segments):
+            stage.segments = count
+
+    # backward holds the gradients of about two activations at a time
+    transient = 2 * max(v for run in saved.values() for v in run.values())
+    kept = saved.pop(None)
+    largest = max(
+        (sum(v for k, v in run.items() if k not in kept) for run in saved.values()),
+        default=0,
+    )
+    return sum(kept.values()) + largest + transient
+
+
+def _step_bytes(model: nn.Module, x: torch.Tensor) -> float:
+    """Peak memory of one train step on `x`, `inf` when it does not fit
+
+    On CUDA the allocator peak of forward and backward is measured. On CPU
+    there is no allocator peak, the tensors kept for backward are summed
+    instead (`_saved_bytes`, plus weights and gradients).
+    """
+    if x.device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(x.device)
+        try:
+            sum(o.float().mean() for o in _outputs(model(x))).backward()
+        except RuntimeError as e:
+            if "out of memory" not in str(e):
+                raise
+            return math.inf
+        finally:
+            model.zero_grad(set_to_none=True)
+        return torch.cuda.max_memory_allocated(x.device)
+    return _parameter_bytes(model) + _saved_bytes(model, x)
+
+
+def probe_batch_size(
+    model: nn.Module,
+    input_shape: Sequence[int],
+    max_batch_size: int,
+    budget_bytes: float,
+    device: Union[str, torch.device] = "cpu",
+) -> int:
+    """Largest batch size up to `max_batch_size` whose train step fits the budget
+
+    Batch sizes are doubled until one does not fit, then bisected. On CUDA
+    every candidate runs one train step on random [B, *input_shape] inputs.
+    A CPU step over the budget would swap or get the process killed, so
+    there the footprint is measured at batch sizes 1 and 2 and extrapolated
+    linearly (activations grow with the batch, weights do not). Weights,
+    buffers (BatchNorm running stats), gradients and the RNG state are
+    restored. Returns 0 when not even a single sample fits.
+    """
+    device = torch.device(device)
+    state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+    training = model.training
+    model.to(device).train()
+
+    def measure(batch_size: int) -> float:
+        x = torch.rand(batch_size, *input_shape, device=device)
+        return _step_bytes(model, x)
+
+    devices = [device] if device.type == "cuda" else []
+    with torch.random.fork_rng(devices=devices):
+        if device.type == "cuda":
+            fits = lambda batch_size: measure(batch_size) <= budget_bytes
+        else:
+            one = measure(1)
+            per_sample = measure(2) - one
+            fits = (
+                lambda batch_size: one + (batch_size - 1) * per_sample <= budget_bytes
+            )
+
+        low, high = 0, 1
+        # doubling: `low` fits, `high` does not (or is past the maximum)
+        while high <= max_batch_size and fits(high):
+            low, high = high, high * 2
+        high = min(high, max_batch_size + 1)
+        while high - low > 1:
+            middle = (low + high) // 2
+            low, high = (middle, high) if fits(middle) else (low, middle)
+
+    model.load_state_dict(state)
+    model.zero_grad(set_to_none=True)
+    model.train(training)
+    return low
+
+
+def plan_batch_size(batch_size: int, max_batch_size: int) -> Tuple[int, int]:
+    """(per step batch size, accumulation) for an effective `batch_size`
+
+    The largest per step batch that fits and divides `batch_size`, so the
+    effective batch is exact: 256 with at most 100 per step -> (64, 4).
+    When the largest such divisor is under half of what fits (e.g. a
+    prime `batch_size`), the fewest accumulation steps with the batch
+    spread evenly, the effective batch rounded up: 257, 100 -> (86, 3).
+    """
+    if max_batch_size < 1:
+        raise ValueError("not a single sample fits the memory budget")
+    max_batch_size = min(max_batch_size, batch_size)
+    divisor = max(d for d in range(1, max_batch_size + 1) if batch_size % d == 0)
+    if 2 * divisor >= max_batch_size:
+        return divisor, batch_size // divisor
+    accumulation = math.ceil(batch_size / max_batch_size)
+    return math.ceil(batch_size / accumulation), accumulation
+
+
+def _default_budget(device: torch.device) -> float:
+    # 90% of the GPU, half of the host memory
+    if device.type == "cuda":
+        return 0.9 * torch.cuda.get_device_properties(device).total_memory
+    return 0.5 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def auto_batch_size(
+    model: nn.Module,
+    input_shape: Sequence[int],
+    batch_size: int,
+    path: str,
+    budget_gb: Optional[float] = None,
+    device: Union[str, torch.device] = "cpu",
+) -> Dict[str, Any]:
+    """Probe, plan and record the batch size for an effective `batch_size`
+
+    The result is written as JSON to `path` and reused by later runs with the
+    same model, activation checkpointing, input shape, batch size, budget
+    and device. Returns the
+    record, `batch_size` and `accumulate_grad_batches` are the ones to train
+    with.
+    """
+    device = torch.device(device)
+    budget = budget_gb * 1024**3 if budget_gb else _default_budget(device)
+    key = {
+        "model": type(model).__name__,
+        "parameters": sum(p.numel() for p in model.parameters()),
+        # `--checkpoint_segments` changes the footprint, not the model
+        "checkpoint_segments": sorted({stage.segments for stage in _stages(model)}),
+        "input_shape": list(input_shape),
+        "effective_batch_size": batch_size,
+        "budget_bytes": int(budget),
+        "device": (
+            torch.cuda.get_device_name(device) if device.type == "cuda" else "cpu"
+        ),
+    }
+    if os.path.isfile(path):
+        with open(path) as f:
+            record = json.load(f)
+        if record.get("key") == key:
+            rank_zero_info(
+                f"[auto batch size] {record['batch_size']} x "
+                f"{record['accumulate_grad_batches']} accumulation, effective "
+                f"batch {record['effective_batch_size']} (reusing {path})"
+            )
+            return record
+
+    max_batch_size = probe_batch_size(model, input_shape, batch_size, budget, device)
+    per_step, accumulation = plan_batch_size(batch_size, max_batch_size)
+    record = {
+        "key": key,
+        "max_batch_size": max_batch_size,
+        "batch_size": per_step,
+        "accumulate_grad_batches": accumulation,
+        "effective_batch_size": per_step * accumulation,
+    }
+    rank_zero_info(
+        f"[auto batch size] {per_step} x {accumulation} accumulation, "
+        f"effective batch {per_step * accumulation} "
+        f"(at most {max_batch_size} fit in {budget / 1024 ** 3:.1f} GiB)"
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # every DDP rank probes, the record is replaced atomically
+    with open(f"{path}.{os.getpid()}", "w") as f:
+        json.dump(record, f, indent=2)
+    os.replace(f"{path}.{os.getpid()}", path)
+    return record
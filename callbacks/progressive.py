@@ -0,0 +1,48 @@
+from typing import *
+
+import pytorch_lightning as pl
+from pytorch_lightning.utilities import rank_zero_info
+
+__all__ = ["ProgressiveResize", "parse_schedule"]
+
+
+def parse_schedule(items: List[str]) -> Dict[int, int]:
+    """["0:128", "4:160", "8:224"] -> {0: 128, 4: 160, 8: 224}"""
+    schedule = {}
+    for item in items:
+        epoch, size = item.split(":")
+        schedule[int(epoch)] = int(size)
+    return schedule
+
+
+class ProgressiveResize(pl.Callback):
+    """Train transforms resolution following a per-epoch schedule
+
+    `schedule` maps the first epoch of every phase to its image size, e.g.
+    `{0: 128, 4: 160, 8: 224}`; epochs before the first phase keep the size
+    the transforms were built with. The size reaches the datamodule through
+    `set_image_size` at epoch boundaries, eval transforms are left alone.
+    The model has to accept every size (adaptive pooling heads).
+    """
+
+    def __init__(self, schedule: Dict[int, int]) -> None:
+        self.schedule = dict(sorted(schedule.items()))
+
+    def image_size(self, epoch: int) -> Optional[int]:
+        sizes = [size for start, size in self.schedule.items() if start <= epoch]
+        return sizes[-1] if sizes else None
+
+    def _apply(self, trainer: pl.Trainer, epoch: int) -> None:
+        image_size = self.image_size(epoch)
+        set_image_size = getattr(trainer.datamodule, "set_image_size", None)
+        if image_size is None or set_image_size is None:
+            return
+        rank_zero_info(f"[progressive resize] epoch {epoch}: {image_size}px")
+        set_image_size(image_size)
+
+    def on_train_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        self._apply(trainer, trainer.current_epoch)
+
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule):
+        # before the next epoch's loader iterator wakes the workers up
+        self._apply(trainer, trainer.current_epoch + 1)
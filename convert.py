@@ -0,0 +1,98 @@
+import os
+import time
+from argparse import ArgumentParser
+from typing import *
+
+import cv2
+import numpy as np
+
+from datamodules import *
+from datamodules.cache import split_images
+from datamodules.folder import find_images
+from datamodules.LMDB import write_lmdb
+
+# datamodules backed by a torchvision dataset, plus plain image folders
+SOURCE_TABLE: List[str] = [
+    name for name in DATAMODULE_TABLE.keys() if name not in ["SHARDS", "LMDB"]
+]
+
+
+def hyperparameters():
+    parser = ArgumentParser()
+    add = parser.add_argument
+
+    add("--dataset", type=str, choices=SOURCE_TABLE)
+    add("--root_dir", type=str)
+    add("--out_dir", type=str)
+    add("--ext", type=str, choices=[".png", ".jpg"], default=".png")
+    add("--jpeg_quality", type=int, default=95)
+
+    return parser.parse_args()
+
+
+def encode(
+    images: Iterable[np.ndarray],
+    targets: Iterable[int],
+    ext: str = ".png",
+    jpeg_quality: int = 95,
+) -> Iterator[Tuple[bytes, int]]:
+    """uint8 RGB / gray arrays to encoded (bytes, label) pairs"""
+    params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if ext == ".jpg" else []
+    for image, label in zip(images, targets):
+        image = np.asarray(image)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        yield cv2.imencode(ext, image, params)[1].tobytes(), int(label)
+
+
+def source_samples(args, split: str) -> Optional[Iterator[Tuple[bytes, int]]]:
+    """(encoded image, label) of a train / test split, None if missing"""
+    if args.dataset == "FOLDER":
+        split_dir = os.path.join(args.root_dir, split)
+        if not os.path.isdir(split_dir):
+            return None
+        classes = find_images(os.path.join(args.root_dir, "train"))[2]
+        paths, targets, _ = find_images(split_dir, classes)
+
+        def read(path: str) -> bytes:
+            with open(path, "rb") as f:
+                return f.read()
+
+        # already encoded, stored as they are
+        return ((read(path), target) for path, target in zip(paths, targets))
+
+    datamodule = DATAMODULE_TABLE[args.dataset](
+        root_dir=args.root_dir,
+        train_transforms=None,
+        val_transforms=None,
+        test_transforms=None,
+        batch_size=1,
+        num_workers=0,
+    )
+    datamodule.prepare_data()
+    dataset = datamodule.Dataset(args.root_dir, train=split == "train")
+    images, _ = split_images(dataset, split, None, args.root_dir)
+    return encode(images, dataset.targets, args.ext, args.jpeg_quality)
+
+
+def main(args):
+    for split in ["train", "test"]:
+        samples = source_samples(args, split)
+        if samples is None:
+            print(f"{split}: no split, skipped")
+            continue
+
+        path = os.path.join(args.out_dir, f"{split}.lmdb")
+        start = time.perf_counter()
+        num_samples = write_lmdb(samples, path)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path) / 2**20
+        print(
+            f"{split}: {num_samples} samples, {size:.1f} MiB -> {path} "
+            f"({num_samples / elapsed:.0f} samples/sec)"
+        )
+
+
+if __name__ == "__main__":
+    args = hyperparameters()
+    main(args)
@@ -1,15 +1,16 @@
 from typing import *
 
-import pytorch_lightning as pl
-from sklearn.model_selection import train_test_split
-from torch.utils.data import DataLoader, Subset
 from torchvision.datasets import CIFAR10, CIFAR100
-import numpy as np
+
+from .base import DataModuleBase
+from .cache import *
+from .download import materialize, verified
+from .split import cached_split
 
 __all__ = ["CIFAR10DataModule", "CIFAR100DataModule"]
 
 
-class CIFARDataModuleBase(pl.LightningDataModule):
+class CIFARDataModuleBase(DataModuleBase):
     def __init__(
         self,
         DATASET: Union[CIFAR10, CIFAR100],
@@ -19,85 +20,84 @@ class CIFARDataModuleBase(pl.LightningDataModule):
         test_transforms: Callable,
         batch_size: int = 256,
         num_workers: int = 8,
+        **kwargs,
     ):
-        super().__init__()
-        self.save_hyperparameters(
-            {
-                "root_dir": root_dir,
-                "batch_size": batch_size,
-                "num_workers": num_workers,
-            },
+        super().__init__(
+            root_dir,
+            train_transforms,
+            val_transforms,
+            test_transforms,
+            batch_size,
+            num_workers,
+            **kwargs,
         )
         self.Dataset = DATASET
-        self.train_transforms = train_transforms
-        self.val_transforms = val_transforms
-        self.test_transforms = test_transforms
 
     def prepare_data(self) -> None:
-        """Dataset download"""
-        self.Dataset(self.hparams.root_dir, train=True, download=True)
-        self.Dataset(self.hparams.root_dir, train=False, download=True)
+        """Dataset download, skipped while the verified manifest holds"""
+        materialize(self.Dataset, self.hparams.root_dir, self.hparams.mirror)
 
     def setup(self, stage: Optional[str] = None) -> None:
+        Dataset = verified(self.Dataset, self.hparams.root_dir)
         if stage == "fit" or stage is None:
-            # split dataset to train, val
-            ds = self.Dataset(self.hparams.root_dir, train=True)
+            # load the train split once, train/val are index views onto it
+            ds = Dataset(self.hparams.root_dir, train=True)
             targets = ds.targets
-            train_idx, val_idx = train_test_split(
-                np.arange(len(targets)),
-                test_size=0.2,
-                shuffle=True,
-                stratify=targets,
+            train_idx, val_idx = cached_split(
+                targets,
+                dataset_name(ds),
+                self.hparams.root_dir,
+                self.hparams.val_size,
+                self.hparams.seed,
             )
 
-            # build dataset, different transforms
-            self.train_ds = Subset(
-                self.Dataset(
-                    self.hparams.root_dir,
-                    train=True,
-                    transform=self.train_transforms,
-                ),
+            images, channels_last = split_images(
+                ds, "train", self.hparams.cache, self.hparams.root_dir
+            )
+            self.train_ds = TensorCacheDataset(
+                images,
+                targets,
+                self.train_transforms,
                 train_idx,
+                channels_last,
             )
-            self.val_ds = Subset(
-                self.Dataset(
-                    self.hparams.root_dir,
-                    train=True,
-                    transform=self.test_transforms,
-                ),
+            self.val_ds = TensorCacheDataset(
+                images,
+                targets,
+                self.val_transforms,
                 val_idx,
+                channels_last,
             )
 
-        if stage == "test" or stage is None:
-            self.test_ds = self.Dataset(
-                self.hparams.root_dir,
-                train=False,
-                transform=self.test_transforms,
-            )
-
-    def train_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.train_ds,
-            batch_size=self.hparams.batch_size,
-            shuffle=True,
-            num_workers=self.hparams.num_workers,
-        )
-
-    def val_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.val_ds,
-            batch_size=self.hparams.batch_size,
-            shuffle=False,
-            num_workers=self.hparams.num_workers,
-        )
+            if self.hparams.eval_cache:
+                # val reads images resized once, no per-epoch resize
+                self.val_ds = build_eval_cache(
+                    ds,
+                    "val",
+                    self.val_transforms,
+                    self.hparams.root_dir,
+                    val_idx,
+                )
 
-    def test_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.test_ds,
-            batch_size=self.hparams.batch_size,
-            shuffle=False,
-            num_workers=self.hparams.num_workers,
-        )
+        if stage == "test" or stage is None:
+            ds = Dataset(self.hparams.root_dir, train=False)
+            if self.hparams.eval_cache:
+                self.test_ds = build_eval_cache(
+                    ds,
+                    "test",
+                    self.test_transforms,
+                    self.hparams.root_dir,
+                )
+            else:
+                images, channels_last = split_images(
+                    ds, "test", self.hparams.cache, self.hparams.root_dir
+                )
+                self.test_ds = TensorCacheDataset(
+                    images,
+                    ds.targets,
+                    self.test_transforms,
+                    channels_last=channels_last,
+                )
 
 
 def CIFAR10DataModule(**kwargs):
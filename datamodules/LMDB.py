@@ -0,0 +1,189 @@
+from typing import *
+import hashlib
+import os
+import struct
+
+import numpy as np
+from torch.utils.data import Dataset
+
+from .base import DataModuleBase
+from .cache import apply_transform
+from .shards import _decode
+from .split import cached_split
+
+try:
+    import lmdb
+except ImportError:  # optional, only needed for LMDB datasets
+    lmdb = None
+
+__all__ = ["LMDBDataModule", "LMDBDataset", "write_lmdb"]
+
+# every value is a little endian int64 label followed by the encoded image
+_LABEL = struct.Struct("<q")
+_TARGETS_KEY = b"__targets__"
+
+
+def _require_lmdb() -> None:
+    if lmdb is None:
+        raise ImportError("LMDB datasets need the `lmdb` package: pip install lmdb")
+
+
+# read-only environments of this process, one per file, shared by all views
+_ENVS: Dict[Tuple[str, int], "lmdb.Environment"] = {}
+
+
+def _open_env(path: str) -> "lmdb.Environment":
+    # an environment must not cross a fork, forked workers drop the inherited
+    # handle (read-only and lock-free, closing only unmaps it here) and reopen
+    path = os.path.abspath(path)
+    key = (path, os.getpid())
+    if key not in _ENVS:
+        for stale in [k for k in _ENVS if k[0] == path]:
+            _ENVS.pop(stale).close()
+        _ENVS[key] = lmdb.open(
+            path,
+            subdir=False,
+            readonly=True,
+            lock=False,
+            # random access, OS read-ahead would only evict useful pages
+            readahead=False,
+            meminit=False,
+        )
+    return _ENVS[key]
+
+
+def _key(index: int) -> bytes:
+    return f"{index:09d}".encode()
+
+
+def write_lmdb(
+    samples: Iterable[Tuple[bytes, int]],
+    path: str,
+    commit_every: int = 1000,
+) -> int:
+    """Write (encoded image bytes, label) pairs into a single-file LMDB
+
+    The map grows on demand. All labels are also stored under one key so
+    readers can split the dataset without touching a single image.
+    Returns the number of samples written.
+    """
+    _require_lmdb()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    env = lmdb.open(path, subdir=False, map_size=1 << 30, meminit=False)
+
+    def put(items: List[Tuple[bytes, bytes]]) -> None:
+        while True:
+            try:
+                with env.begin(write=True) as txn:
+                    for key, value in items:
+                        txn.put(key, value)
+                return
+            except lmdb.MapFullError:
+                env.set_mapsize(env.info()["map_size"] * 2)
+
+    items, targets = [], []
+    for index, (payload, label) in enumerate(samples):
+        items.append((_key(index), _LABEL.pack(int(label)) + payload))
+        targets.append(int(label))
+        if len(items) == commit_every:
+            put(items)
+            items = []
+    items.append((_TARGETS_KEY, np.asarray(targets, dtype=np.int64).tobytes()))
+    put(items)
+
+    env.sync()
+    env.close()
+    return len(targets)
+
+
+class LMDBDataset(Dataset):
+    """View of an LMDB written by `write_lmdb`
+
+    The file is opened read-only and memory-mapped once per process (every
+    worker opens its own), so a sample is a page-cache lookup plus an image
+    decode, no file `open`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        transform: Optional[Callable] = None,
+        indices: Optional[Sequence[int]] = None,
+    ) -> None:
+        _require_lmdb()
+        self.path = path
+        self.transform = transform
+        self.indices = None if indices is None else np.asarray(indices)
+
+        with _open_env(path).begin() as txn:
+            targets = np.frombuffer(txn.get(_TARGETS_KEY), dtype=np.int64)
+        self.targets = targets if indices is None else targets[self.indices]
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> Tuple[Any, int]:
+        i = index if self.indices is None else self.indices[index]
+        with _open_env(self.path).begin(buffers=True) as txn:
+            value = txn.get(_key(int(i)))
+            image = _decode(value[_LABEL.size :])
+
+        image = apply_transform(self.transform, image, int(i))
+        return image, int(self.targets[index])
+
+
+class LMDBDataModule(DataModuleBase):
+    """Datamodule over `<root_dir>/{train,test}.lmdb` built by `convert.py`
+
+    `val_size` of train is held out for validation (stratified, see
+    `cached_split`); without `test.lmdb` val is used for testing.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        train_transforms: Callable,
+        val_transforms: Callable,
+        test_transforms: Callable,
+        batch_size: int = 256,
+        num_workers: int = 8,
+        **kwargs,
+    ):
+        super().__init__(
+            root_dir,
+            train_transforms,
+            val_transforms,
+            test_transforms,
+            batch_size,
+            num_workers,
+            **kwargs,
+        )
+        if self.hparams.cache is not None or self.hparams.eval_cache:
+            raise ValueError("cache/eval_cache are not supported for LMDB")
+
+    def setup(self, stage: Optional[str] = None) -> None:
+        root_dir = self.hparams.root_dir
+        train_path = os.path.join(root_dir, "train.lmdb")
+        test_path = os.path.join(root_dir, "test.lmdb")
+
+        targets = LMDBDataset(train_path).targets
+        stat = os.stat(train_path)
+        digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        name = os.path.basename(os.path.normpath(root_dir))
+        train_idx, val_idx = cached_split(
+            targets,
+            f"LMDB-{name}-{digest.hexdigest()[:12]}",
+            root_dir,
+            self.hparams.val_size,
+            self.hparams.seed,
+        )
+
+        if stage == "fit" or stage is None:
+            self.train_ds = LMDBDataset(train_path, self.train_transforms, train_idx)
+            self.val_ds = LMDBDataset(train_path, self.val_transforms, val_idx)
+
+        if stage == "test" or stage is None:
+            if os.path.exists(test_path):
+                self.test_ds = LMDBDataset(test_path, self.test_transforms)
+            else:
+                self.test_ds = LMDBDataset(train_path, self.test_transforms, val_idx)
@@ -1,12 +1,17 @@
 from typing import *
+from functools import partial
+
 import pytorch_lightning as pl
-from torch.utils.data import DataLoader, Subset, Dataset
+from torch.utils.data import Dataset
 from torchvision.datasets import MNIST, FashionMNIST, EMNIST, KMNIST
-from sklearn.model_selection import train_test_split
-import numpy as np
+
+from .base import DataModuleBase
+from .cache import *
+from .download import materialize, verified
+from .split import cached_split
 
 
-class MnistDataModuleBase(pl.LightningDataModule):
+class MnistDataModuleBase(DataModuleBase):
     def __init__(
         self,
         DATASET: Dataset,
@@ -16,87 +21,94 @@ class MnistDataModuleBase(pl.LightningDataModule):
         test_transforms: Callable,
         batch_size: int,
         num_workers: int,
+        **kwargs,
     ):
-        super().__init__()
-        self.save_hyperparameters(
-            {
-                "root_dir": root_dir,
-                "batch_size": batch_size,
-                "num_workers": num_workers,
-            },
+        super().__init__(
+            root_dir,
+            train_transforms,
+            val_transforms,
+            test_transforms,
+            batch_size,
+            num_workers,
+            **kwargs,
         )
         self.Dataset = DATASET
-        self.train_transforms = train_transforms
-        self.val_transforms = val_transforms
-        self.test_transforms = test_transforms
+        self._splits = {}
 
     def prepare_data(self) -> None:
-        """Dataset download"""
-        self.Dataset(self.hparams.root_dir, train=True, download=True)
-        self.Dataset(self.hparams.root_dir, train=False, download=True)
+        """Dataset download, skipped while the verified manifest holds"""
+        materialize(self.Dataset, self.hparams.root_dir, self.hparams.mirror)
+
+    def _split(self, split: str) -> Tuple[Dataset, Any, bool]:
+        """torchvision split and its images (see `split_images`), loaded once
+
+        Later `setup` calls (fit then test, repeated `trainer.test`) reuse
+        them instead of reading the raw files again.
+        """
+        if split not in self._splits:
+            Dataset = verified(self.Dataset, self.hparams.root_dir)
+            ds = Dataset(self.hparams.root_dir, train=split == "train", download=False)
+            images, channels_last = split_images(
+                ds, split, self.hparams.cache, self.hparams.root_dir
+            )
+            self._splits[split] = (ds, images, channels_last)
+        return self._splits[split]
 
     def setup(self, stage: Optional[str] = None) -> None:
         if stage == "fit" or stage is None:
-            # split dataset to train, val
-            ds = self.Dataset(self.hparams.root_dir, train=True, download=False)
+            # load the train split once, train/val are index views onto it
+            ds, images, channels_last = self._split("train")
             targets = ds.targets
-            train_idx, val_idx = train_test_split(
-                np.arange(len(targets)),
-                test_size=0.2,
-                shuffle=True,
-                stratify=targets,
+            train_idx, val_idx = cached_split(
+                targets,
+                dataset_name(ds),
+                self.hparams.root_dir,
+                self.hparams.val_size,
+                self.hparams.seed,
             )
 
-            # build dataset, different transforms
-            self.train_ds = Subset(
-                self.Dataset(
-                    self.hparams.root_dir,
-                    train=True,
-                    transform=self.train_transforms,
-                    download=False,
-                ),
+            self.train_ds = TensorCacheDataset(
+                images,
+                targets,
+                self.train_transforms,
                 train_idx,
+                channels_last,
             )
-            self.val_ds = Subset(
-                self.Dataset(
-                    self.hparams.root_dir,
-                    train=True,
-                    transform=self.val_transforms,
-                    download=False,
-                ),
+            self.val_ds = TensorCacheDataset(
+                images,
+                targets,
+                self.val_transforms,
                 val_idx,
+                channels_last,
             )
 
-        if stage == "test" or stage is None:
-            self.test_ds = MNIST(
-                self.hparams.root_dir,
-                train=False,
-                transform=self.test_transforms,
-            )
-
-    def train_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.train_ds,
-            batch_size=self.hparams.batch_size,
-            shuffle=True,
-            num_workers=self.hparams.num_workers,
-        )
-
-    def val_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.val_ds,
-            batch_size=self.hparams.batch_size,
-            shuffle=False,
-            num_workers=self.hparams.num_workers,
-        )
+            if self.hparams.eval_cache:
+                # val reads images resized once, no per-epoch resize
+                self.val_ds = build_eval_cache(
+                    ds,
+                    "val",
+                    self.val_transforms,
+                    self.hparams.root_dir,
+                    val_idx,
+                )
 
-    def test_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.test_ds,
-            batch_size=self.hparams.batch_size,
-            shuffle=False,
-            num_workers=self.hparams.num_workers,
-        )
+        if stage == "test" or stage is None:
+            # the datamodule's own dataset class, not always MNIST
+            ds, images, channels_last = self._split("test")
+            if self.hparams.eval_cache:
+                self.test_ds = build_eval_cache(
+                    ds,
+                    "test",
+                    self.test_transforms,
+                    self.hparams.root_dir,
+                )
+            else:
+                self.test_ds = TensorCacheDataset(
+                    images,
+                    ds.targets,
+                    self.test_transforms,
+                    channels_last=channels_last,
+                )
 
 
 def MnistDataModule(**kwargs):
@@ -108,7 +120,8 @@ def FashionMnistDataModule(**kwargs):
 
 
 def EmnistDataModule(**kwargs):
-    DATASET = lambda root, **kwargs: EMNIST(root, "byclass", **kwargs)
+    # a partial, not a lambda, so `download` can look up its files
+    DATASET = partial(EMNIST, split="byclass")
     return MnistDataModuleBase(DATASET, **kwargs)
 
 
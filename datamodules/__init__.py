@@ -1,5 +1,11 @@
+from datamodules.base import DataModuleBase
 from datamodules.MNIST import *
 from datamodules.CIFAR import *
+from datamodules.shards import ShardDataModule
+from datamodules.folder import ImageFolderDataModule
+from datamodules.LMDB import LMDBDataModule
+from datamodules.cache import CACHE_MODES
+from datamodules.samplers import SAMPLER_TABLE
 
 DATAMODULE_TABLE: Dict["str", pl.LightningDataModule] = {
     "MNIST": MnistDataModule,
@@ -8,6 +14,9 @@ DATAMODULE_TABLE: Dict["str", pl.LightningDataModule] = {
     "KMNIST": KMnistDataModule,
     "CIFAR10": CIFAR10DataModule,
     "CIFAR100": CIFAR100DataModule,
+    "SHARDS": ShardDataModule,
+    "FOLDER": ImageFolderDataModule,
+    "LMDB": LMDBDataModule,
 }
 
 __all__ = [
@@ -19,6 +28,18 @@ __all__ = [
     # CIFAR
     "CIFAR10DataModule",
     "CIFAR100DataModule",
+    # shards
+    "ShardDataModule",
+    # folder
+    "ImageFolderDataModule",
+    # LMDB
+    "LMDBDataModule",
+    # base
+    "DataModuleBase",
+    # cache
+    "CACHE_MODES",
+    # samplers
+    "SAMPLER_TABLE",
     # TABLE
     "DATAMODULE_TABLE",
 ]
@@ -0,0 +1,234 @@
+from typing import *
+import time
+
+import pytorch_lightning as pl
+from pytorch_lightning.utilities import rank_zero_info, rank_zero_warn
+from pytorch_lightning.utilities.seed import pl_worker_init_function
+import numpy as np
+import torch
+from torch.utils.data import (
+    DataLoader,
+    Dataset,
+    IterableDataset,
+    RandomSampler,
+    Sampler,
+)
+
+from .collate import SharedBatchCollate
+from .samplers import SAMPLER_TABLE, IndexedDataset
+
+__all__ = ["DataModuleBase", "benchmark_loader"]
+
+
+def benchmark_loader(loader: DataLoader, num_batches: int = 20) -> float:
+    """batches/sec of `loader`, the first batch (worker start up) excluded"""
+    iterator = iter(loader)
+    next(iterator)
+    start, count = time.perf_counter(), 0
+    for _ in range(num_batches):
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        count += 1
+    elapsed = time.perf_counter() - start
+    del iterator
+    return count / elapsed if elapsed > 0 else float("inf")
+
+
+class DataModuleBase(pl.LightningDataModule):
+    """DataLoader construction shared by every datamodule
+
+    Subclasses build `train_ds`, `val_ds` and `test_ds` in `setup`, holding
+    out `val_size` of the train split for validation, split with `seed`, and
+    honour `cache` / `eval_cache` (see `datamodules.cache`) where they can.
+    Workers are persistent by default so they survive epochs and train/val
+    switches, and every worker is seeded with `pl_worker_init_function`.
+    With `autotune` a few worker/prefetch configurations are timed on the
+    train split when the first loader is built and the fastest is kept for
+    all three loaders. `sampler` (see `SAMPLER_TABLE`) replaces the shuffled
+    pass over `train_ds` with `samples_per_epoch` drawn samples per epoch.
+    With `shared_collate` workers stack batches into a ring of reused shared
+    memory buffers (see `SharedBatchCollate`); it requires `pin_memory`,
+    which copies every batch out of the ring. Downloading datamodules fetch
+    from `mirror` first (see `datamodules.download`).
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        train_transforms: Callable,
+        val_transforms: Callable,
+        test_transforms: Callable,
+        batch_size: int = 256,
+        num_workers: int = 8,
+        cache: Optional[str] = None,
+        eval_cache: bool = False,
+        pin_memory: bool = False,
+        persistent_workers: bool = True,
+        prefetch_factor: int = 2,
+        autotune: bool = False,
+        val_size: float = 0.2,
+        seed: int = 0,
+        sampler: Optional[str] = None,
+        samples_per_epoch: Optional[int] = None,
+        shared_collate: bool = False,
+        mirror: Optional[str] = None,
+    ):
+        super().__init__()
+        if shared_collate and not pin_memory:
+            # a ring slot is only safe to rewrite once the batch is copied out
+            raise ValueError("shared_collate requires pin_memory")
+        self.save_hyperparameters(
+            {
+                "root_dir": root_dir,
+                "batch_size": batch_size,
+                "num_workers": num_workers,
+                "cache": cache,
+                "eval_cache": eval_cache,
+                "pin_memory": pin_memory,
+                "persistent_workers": persistent_workers,
+                "prefetch_factor": prefetch_factor,
+                "autotune": autotune,
+                "val_size": val_size,
+                "seed": seed,
+                "sampler": sampler,
+                "samples_per_epoch": samples_per_epoch,
+                "shared_collate": shared_collate,
+                "mirror": mirror,
+            },
+        )
+        self.train_transforms = train_transforms
+        self.val_transforms = val_transforms
+        self.test_transforms = test_transforms
+        self._tuned = not autotune
+        self.sampler = None
+        # default train shuffle, keyed by (seed, epoch) like the augmentation
+        self._shuffle_generator = torch.Generator()
+        self._seed_shuffle(0)
+
+    def _loader_kwargs(self, **overrides) -> Dict[str, Any]:
+        kwargs = {
+            "batch_size": self.hparams.batch_size,
+            "num_workers": self.hparams.num_workers,
+            "pin_memory": self.hparams.pin_memory,
+        }
+        kwargs.update(overrides)
+
+        # only valid with worker processes
+        if kwargs["num_workers"] > 0:
+            kwargs.setdefault("persistent_workers", self.hparams.persistent_workers)
+            kwargs.setdefault("prefetch_factor", self.hparams.prefetch_factor)
+            kwargs.setdefault("worker_init_fn", pl_worker_init_function)
+            if self.hparams.shared_collate and not (
+                kwargs["pin_memory"] and torch.cuda.is_available()
+            ):
+                # the DataLoader does not pin without CUDA: no copy
+                rank_zero_warn("shared_collate needs pin_memory on CUDA, disabled")
+            elif self.hparams.shared_collate:
+                # batches queued per worker, plus the one being pinned
+                ring_size = kwargs["prefetch_factor"] + 1
+                kwargs.setdefault("collate_fn", SharedBatchCollate(ring_size))
+        else:
+            kwargs.pop("persistent_workers", None)
+            kwargs.pop("prefetch_factor", None)
+        return kwargs
+
+    def _autotune_candidates(self) -> List[Dict[str, int]]:
+        num_workers = self.hparams.num_workers
+        workers = sorted(
+            {max(1, num_workers // 4), max(1, num_workers // 2), num_workers}
+        )
+        return [
+            {"num_workers": w, "prefetch_factor": p}
+            for w in workers
+            for p in sorted({2, 4, self.hparams.prefetch_factor})
+        ]
+
+    def autotune(self, dataset: Dataset, num_batches: int = 20) -> Dict[str, int]:
+        """Pick the fastest worker/prefetch configuration by batches/sec"""
+        results = []
+        for candidate in self._autotune_candidates():
+            loader = DataLoader(
+                dataset,
+                shuffle=not isinstance(dataset, IterableDataset),
+                **self._loader_kwargs(persistent_workers=False, **candidate),
+            )
+            speed = benchmark_loader(loader, num_batches)
+            rank_zero_info(f"[autotune] {candidate}: {speed:.2f} batches/sec")
+            results.append((speed, candidate))
+
+        speed, best = max(results, key=lambda result: result[0])
+        rank_zero_info(f"[autotune] picked {best}: {speed:.2f} batches/sec")
+        self.hparams.update(best)
+        self._tuned = True
+        return best
+
+    def _seed_shuffle(self, epoch: int) -> None:
+        seed = np.random.SeedSequence([self.hparams.seed, epoch]).generate_state(1)
+        self._shuffle_generator.manual_seed(int(seed[0]))
+
+    def set_epoch(self, epoch: int) -> None:
+        """Forward the training epoch to epoch aware train data/transforms"""
+        self._seed_shuffle(epoch)
+        train_ds = getattr(self, "train_ds", None)
+        for target in [train_ds, self.sampler, self.train_transforms]:
+            set_epoch = getattr(target, "set_epoch", None)
+            if set_epoch is not None:
+                set_epoch(epoch)
+
+    def record_losses(self, indices, losses) -> None:
+        """Per-sample train losses, for loss driven samplers"""
+        record_losses = getattr(self.sampler, "record_losses", None)
+        if record_losses is not None:
+            record_losses(indices, losses)
+
+    def set_image_size(self, image_size: int) -> None:
+        """Resize the train transforms output, e.g. for progressive resizing"""
+        set_image_size = getattr(self.train_transforms, "set_image_size", None)
+        if set_image_size is not None:
+            set_image_size(image_size)
+
+    def _dataloader(
+        self,
+        dataset: Dataset,
+        shuffle: bool,
+        sampler: Optional[Sampler] = None,
+    ) -> DataLoader:
+        # sanity check asks for val first, tune on whichever comes first
+        if not self._tuned and hasattr(self, "train_ds"):
+            self.autotune(self.train_ds)
+        # iterable datasets shuffle themselves
+        shuffle = shuffle and not isinstance(dataset, IterableDataset)
+        return DataLoader(
+            dataset, shuffle=shuffle, sampler=sampler, **self._loader_kwargs()
+        )
+
+    def train_dataloader(self) -> DataLoader:
+        if isinstance(self.train_ds, IterableDataset):
+            if self.hparams.sampler is not None:
+                raise ValueError("samplers need a map-style train dataset")
+            return self._dataloader(self.train_ds, shuffle=True)
+
+        if self.hparams.sampler is None:
+            # order independent of the worker count and of other RNG users
+            sampler = RandomSampler(self.train_ds, generator=self._shuffle_generator)
+            return self._dataloader(self.train_ds, shuffle=False, sampler=sampler)
+
+        # kept across dataloader reloads, it holds the epoch and losses
+        if self.sampler is None:
+            self.sampler = SAMPLER_TABLE[self.hparams.sampler](
+                self.train_ds.targets,
+                self.hparams.samples_per_epoch,
+                self.hparams.seed,
+            )
+        dataset = self.train_ds
+        if self.sampler.requires_indices:
+            dataset = IndexedDataset(dataset)
+        return self._dataloader(dataset, shuffle=False, sampler=self.sampler)
+
+    def val_dataloader(self) -> DataLoader:
+        return self._dataloader(self.val_ds, shuffle=False)
+
+    def test_dataloader(self) -> DataLoader:
+        return self._dataloader(self.test_ds, shuffle=False)
@@ -0,0 +1,220 @@
+from typing import *
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+__all__ = [
+    "CACHE_MODES",
+    "dataset_name",
+    "build_tensor_cache",
+    "split_images",
+    "build_eval_cache",
+    "TensorCacheDataset",
+    "apply_transform",
+]
+
+# shared: one uint8 tensor in shared memory, handed to workers by handle
+# mmap  : uint8 `.npy` under `<root_dir>/cache`, memory-mapped read-only
+CACHE_MODES = ["shared", "mmap"]
+
+
+def dataset_name(dataset: Dataset) -> str:
+    """Stable file-name friendly name of a torchvision dataset instance"""
+    name = type(dataset).__name__
+    split = getattr(dataset, "split", None)
+    return name if split is None else f"{name}-{split}"
+
+
+def apply_transform(transform: Optional[Callable], image: Any, index: int) -> Any:
+    """`transform(image)`, handing over the sample index to keyed transforms
+
+    Keyed transforms (`BaseTransforms`) derive the augmentation of a sample
+    from (seed, epoch, index), whichever worker runs it.
+    """
+    if transform is None:
+        return image
+    if getattr(transform, "keyed", False):
+        return transform(image, index)
+    return transform(image)
+
+
+def _save_atomic(cache_path: str, write: Callable[[str], None]) -> None:
+    """write to a temporary `.npy` then rename, readers never see partial files"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path[:-len('.npy')]}.{os.getpid()}.tmp.npy"
+    write(tmp_path)
+    os.replace(tmp_path, cache_path)
+
+
+def _raw_images(dataset: Dataset) -> np.ndarray:
+    """torchvision `.data` (uint8 NHW or NHWC) as a numpy array, no copy"""
+    data = dataset.data
+    return data.numpy() if isinstance(data, torch.Tensor) else np.asarray(data)
+
+
+def _to_nchw(dataset: Dataset) -> np.ndarray:
+    """torchvision `.data` to a contiguous uint8 NCHW array"""
+    data = _raw_images(dataset)
+    if data.ndim == 3:
+        data = data[:, None]
+    else:
+        data = data.transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(data, dtype=np.uint8)
+
+
+def build_tensor_cache(
+    dataset: Dataset,
+    mode: str,
+    cache_path: Optional[str] = None,
+) -> Union[torch.Tensor, np.ndarray]:
+    """Decode a torchvision split once into a uint8 NCHW array
+
+    The raw `.data` of the in-memory torchvision datasets is used directly,
+    so no PIL image is built for any sample.
+    """
+    if mode == "shared":
+        return torch.from_numpy(_to_nchw(dataset)).share_memory_()
+
+    if mode == "mmap":
+        if not os.path.exists(cache_path):
+            _save_atomic(cache_path, lambda p: np.save(p, _to_nchw(dataset)))
+        return np.load(cache_path, mmap_mode="r")
+
+    raise ValueError(f"unknown cache mode: {mode}, expected one of {CACHE_MODES}")
+
+
+def split_images(
+    dataset: Dataset,
+    split: str,
+    cache: Optional[str],
+    root_dir: str,
+) -> Tuple[Union[torch.Tensor, np.ndarray], bool]:
+    """uint8 images of a loaded split and whether they are channels last
+
+    Without `cache` the arrays torchvision already holds in memory are used
+    as they are, so every view of the split shares one copy.
+    """
+    if cache is None:
+        return _raw_images(dataset), True
+
+    cache_path = os.path.join(
+        root_dir, "cache", f"{dataset_name(dataset)}-{split}-uint8.npy"
+    )
+    return build_tensor_cache(dataset, cache, cache_path), False
+
+
+def _eval_cache_path(
+    root_dir: str,
+    name: str,
+    split: str,
+    transforms: Callable,
+    indices: np.ndarray,
+) -> str:
+    c, h, w = transforms.image_shape
+    key = {
+        "dataset": name,
+        "split": split,
+        "image_shape": [c, h, w],
+        "mean": list(transforms.mean),
+        "std": list(transforms.std),
+        "transforms": type(transforms).__name__,
+        "version": transforms.version,
+    }
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode())
+    # val is a subset of the train split, the subset is part of the key
+    digest.update(np.ascontiguousarray(indices, dtype=np.int64).tobytes())
+    file_name = f"{name}-{split}-{c}x{h}x{w}-{digest.hexdigest()[:12]}.npy"
+    return os.path.join(root_dir, "cache", file_name)
+
+
+def build_eval_cache(
+    dataset: Dataset,
+    split: str,
+    transforms: Callable,
+    root_dir: str,
+    indices: Optional[np.ndarray] = None,
+) -> "TensorCacheDataset":
+    """Resize an eval split once to disk and read it back memory-mapped
+
+    The deterministic part of the eval transforms (`transforms.resize`) is
+    stored as uint8 NHWC (one channel for single channel sources) under
+    `<root_dir>/cache`, keyed by dataset, split, image shape, mean/std and
+    transform version. Channels last is the layout
+    `transforms.from_resized` consumes, the only thing left to run per sample.
+    """
+    indices = np.arange(len(dataset.data)) if indices is None else indices
+    cache_path = _eval_cache_path(
+        root_dir, dataset_name(dataset), split, transforms, indices
+    )
+
+    if not os.path.exists(cache_path):
+
+        def write(path: str) -> None:
+            data = _raw_images(dataset)
+            c, h, w = transforms.image_shape
+            if len(indices):
+                # single channel sources are stored on one channel
+                c = transforms.resize(data[indices[0]]).reshape(h, w, -1).shape[2]
+            images = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.uint8, shape=(len(indices), h, w, c)
+            )
+            for i, index in enumerate(indices):
+                image = transforms.resize(data[index])
+                images[i] = image if image.ndim == 3 else image[:, :, None]
+            images.flush()
+            del images
+
+        _save_atomic(cache_path, write)
+
+    return TensorCacheDataset(
+        np.load(cache_path, mmap_mode="r"),
+        np.asarray(dataset.targets)[indices],
+        transforms.from_resized,
+        channels_last=True,
+    )
+
+
+class TensorCacheDataset(Dataset):
+    """View of a uint8 image array with its own transform and index subset
+
+    Images are NCHW, or NHWC / NHW with `channels_last`. Several views (e.g.
+    train and val) can share one array. Samples are handed to `transform` as
+    HWC (HW for single channel) uint8 arrays, the same layout
+    `np.array(PIL.Image)` gives.
+    """
+
+    def __init__(
+        self,
+        images: Union[torch.Tensor, np.ndarray],
+        targets: Sequence[int],
+        transform: Optional[Callable] = None,
+        indices: Optional[Sequence[int]] = None,
+        channels_last: bool = False,
+    ) -> None:
+        targets = np.asarray(targets, dtype=np.int64)
+        self.images = images
+        self.indices = None if indices is None else np.asarray(indices)
+        self.targets = targets if indices is None else targets[self.indices]
+        self.transform = transform
+        self.channels_last = channels_last
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> Tuple[Any, int]:
+        i = index if self.indices is None else self.indices[index]
+        image = np.asarray(self.images[i])
+        if self.channels_last:
+            if image.ndim == 3 and image.shape[2] == 1:
+                image = image[:, :, 0]
+        elif image.shape[0] == 1:
+            image = image[0]
+        else:
+            image = np.ascontiguousarray(image.transpose(1, 2, 0))
+
+        image = apply_transform(self.transform, image, int(i))
+        return image, int(self.targets[index])
@@ -0,0 +1,63 @@
+from typing import *
+
+import torch
+from torch.utils.data import get_worker_info
+from torch.utils.data._utils.collate import default_collate
+
+__all__ = ["SharedBatchCollate"]
+
+
+class SharedBatchCollate:
+    """Collate that stacks images into a per-worker ring of shared buffers
+
+    The default collate allocates a fresh shared memory segment for every
+    batch in every worker (open, truncate, map, first-touch page faults).
+    Here each worker allocates `ring_size` batch buffers in shared memory
+    once and stacks into them in turn, so the main process keeps receiving
+    the same few segments. A buffer is rewritten `ring_size` batches of that
+    worker later, so batches must be copied out of it before: use it with
+    `pin_memory`. The pin thread copies every batch as it arrives and at most
+    `prefetch_factor` batches per worker are in flight, so `ring_size` >=
+    `prefetch_factor` + 1 never rewrites a buffer not yet copied, however
+    long the copies are kept (callbacks, loggers, prefetching trainers).
+
+    Outside workers (`num_workers=0`) this is `default_collate`.
+    """
+
+    def __init__(self, ring_size: int = 4) -> None:
+        self.ring_size = ring_size
+        self._reset(None)
+
+    def _reset(self, sample_shape: Optional[torch.Size]) -> None:
+        self._sample_shape = sample_shape
+        self._ring: List[Optional[torch.Tensor]] = [None] * self.ring_size
+        self._cursor = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # every worker builds its own ring
+        return {"ring_size": self.ring_size}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.ring_size = state["ring_size"]
+        self._reset(None)
+
+    def _buffer(self, sample: torch.Tensor, batch_size: int) -> torch.Tensor:
+        if sample.shape != self._sample_shape:
+            # first batch, or a new image size (progressive resizing)
+            self._reset(sample.shape)
+        buffer = self._ring[self._cursor]
+        if buffer is None or buffer.dtype != sample.dtype or len(buffer) < batch_size:
+            shape = (batch_size, *sample.shape)
+            buffer = torch.empty(shape, dtype=sample.dtype).share_memory_()
+            self._ring[self._cursor] = buffer
+        self._cursor = (self._cursor + 1) % self.ring_size
+        # the last batch of an epoch may be smaller
+        return buffer[:batch_size]
+
+    def __call__(self, batch: List[Tuple[Any, ...]]) -> Any:
+        images, *rest = zip(*batch)
+        if get_worker_info() is None or not isinstance(images[0], torch.Tensor):
+            return default_collate(batch)
+
+        images = torch.stack(images, out=self._buffer(images[0], len(images)))
+        return [images, *(default_collate(list(column)) for column in rest)]
@@ -0,0 +1,248 @@
+from typing import *
+import hashlib
+import json
+import os
+import shutil
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from torchvision.datasets import CIFAR10, EMNIST, MNIST
+
+__all__ = ["RESOURCES_TABLE", "Resource", "fetch", "materialize", "verified"]
+
+
+class Resource(NamedTuple):
+    """A file to fetch to `path`, tried from `urls` in order"""
+
+    urls: List[str]
+    path: str
+    md5: Optional[str] = None
+
+
+def _md5(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _download(url: str, part: str, timeout: float) -> None:
+    """Append `url` to `part`, resuming from its size with a range request"""
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 416:  # `part` is already complete
+            return
+        raise
+    with response:
+        # a server ignoring the range sends the whole file again
+        mode = "ab" if offset and response.status == 206 else "wb"
+        with open(part, mode) as f:
+            shutil.copyfileobj(response, f, 1 << 20)
+
+
+def _fetch_one(resource: Resource, timeout: float) -> str:
+    path, md5 = resource.path, resource.md5
+    if os.path.exists(path) and (md5 is None or _md5(path) == md5):
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    part, errors = f"{path}.part", []
+    for url in resource.urls:
+        try:
+            _download(url, part, timeout)
+        except (OSError, urllib.error.URLError) as e:
+            # the partial file is kept, the next url resumes it
+            errors.append(f"{url}: {e}")
+            continue
+        if md5 is not None and _md5(part) != md5:
+            os.remove(part)
+            errors.append(f"{url}: md5 mismatch")
+            continue
+        os.replace(part, path)
+        return path
+    raise RuntimeError(f"could not fetch {path}:\n" + "\n".join(errors))
+
+
+def fetch(
+    resources: Sequence[Resource],
+    max_workers: int = 4,
+    timeout: float = 60.0,
+) -> List[str]:
+    """Fetch every resource concurrently, resuming `<path>.part` leftovers
+
+    Files already in place with the right md5 are not fetched again. Raises
+    `RuntimeError` when a file can't be fetched from any of its urls.
+    """
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(lambda r: _fetch_one(r, timeout), resources))
+
+
+def _urls(mirror: Optional[str], filename: str, official: List[str]) -> List[str]:
+    if mirror is None:
+        return official
+    return [f"{mirror.rstrip('/')}/{filename}"] + official
+
+
+def _mnist_resources(
+    Dataset: Type, root: str, mirror: Optional[str]
+) -> Tuple[List[Resource], str]:
+    # MNIST, FashionMNIST and KMNIST: gzipped files under <Name>/raw
+    folder = os.path.join(root, Dataset.__name__, "raw")
+    resources = [
+        Resource(
+            _urls(mirror, filename, [m + filename for m in Dataset.mirrors]),
+            os.path.join(folder, filename),
+            md5,
+        )
+        for filename, md5 in Dataset.resources
+    ]
+    return resources, folder
+
+
+def _emnist_resources(
+    Dataset: Type, root: str, mirror: Optional[str]
+) -> Tuple[List[Resource], str]:
+    folder = os.path.join(root, Dataset.__name__, "raw")
+    filename = os.path.basename(Dataset.url)
+    resource = Resource(
+        _urls(mirror, filename, [Dataset.url]),
+        os.path.join(folder, filename),
+        Dataset.md5,
+    )
+    return [resource], folder
+
+
+def _cifar_resources(
+    Dataset: Type, root: str, mirror: Optional[str]
+) -> Tuple[List[Resource], str]:
+    resource = Resource(
+        _urls(mirror, Dataset.filename, [Dataset.url]),
+        os.path.join(root, Dataset.filename),
+        Dataset.tgz_md5,
+    )
+    return [resource], os.path.join(root, Dataset.base_folder)
+
+
+# (resources, folder the dataset reads) of a torchvision dataset class,
+# first match wins (EMNIST is an MNIST subclass, CIFAR100 a CIFAR10 one)
+RESOURCES_TABLE: Dict[Type, Callable] = {
+    EMNIST: _emnist_resources,
+    MNIST: _mnist_resources,
+    CIFAR10: _cifar_resources,
+}
+
+
+def _dataset_class(Dataset: Callable) -> Type:
+    # `partial(EMNIST, split=...)` and friends
+    return Dataset.func if isinstance(Dataset, partial) else Dataset
+
+
+def _resources_of(Dataset: Callable) -> Optional[Callable]:
+    cls = _dataset_class(Dataset)
+    for base, resources in RESOURCES_TABLE.items():
+        if isinstance(cls, type) and issubclass(cls, base):
+            return resources
+    return None
+
+
+def _manifest_path(root: str, Dataset: Callable) -> str:
+    return os.path.join(root, f".{_dataset_class(Dataset).__name__}.manifest.json")
+
+
+def _stat(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _manifest_valid(path: str) -> bool:
+    """Every file listed is still there, same size and modification time"""
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        files = json.load(f)["files"]
+    # paths are relative to the manifest's directory, i.e. `root`
+    root = os.path.dirname(path)
+    try:
+        return all(
+            _stat(os.path.join(root, file)) == stat for file, stat in files.items()
+        )
+    except FileNotFoundError:
+        return False
+
+
+def _write_manifest(path: str, files: List[str]) -> None:
+    root = os.path.dirname(path)
+    manifest = {
+        "files": {os.path.relpath(file, root): _stat(file) for file in sorted(files)}
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def materialize(
+    Dataset: Callable,
+    root: str,
+    mirror: Optional[str] = None,
+    max_workers: int = 4,
+) -> None:
+    """Download and verify a torchvision dataset once, record a manifest
+
+    Unless the dataset is already extracted, archives are fetched
+    concurrently, from `mirror` (`<mirror>/<filename>`) before the official
+    urls, into the paths torchvision expects, so its own `download` only
+    verifies and extracts them. The archives and extracted
+    files are then recorded (size, mtime) in `<root>/.<Name>.manifest.json`;
+    while they match, later calls return without hashing or network access
+    and `verified` skips torchvision's per-construction checksums.
+    Datasets without a `RESOURCES_TABLE` entry use torchvision's download.
+    """
+    resources_of = _resources_of(Dataset)
+    if resources_of is None:
+        Dataset(root, train=True, download=True)
+        Dataset(root, train=False, download=True)
+        return
+
+    manifest_path = _manifest_path(root, Dataset)
+    if _manifest_valid(manifest_path):
+        return
+
+    resources, folder = resources_of(_dataset_class(Dataset), root, mirror)
+    try:
+        # already extracted (and checked by torchvision), e.g. before manifests
+        Dataset(root, train=True)
+        files = [r.path for r in resources if os.path.exists(r.path)]
+    except (RuntimeError, OSError):  # not found, corrupted or incomplete
+        files = fetch(resources, max_workers)
+        # nothing left to download, verify and extract (both splits at once)
+        Dataset(root, train=True, download=True)
+
+    for dirpath, _, filenames in os.walk(folder):
+        files += [os.path.join(dirpath, filename) for filename in filenames]
+    _write_manifest(manifest_path, files)
+
+
+def verified(Dataset: Callable, root: str) -> Callable:
+    """`Dataset` without torchvision's checksum pass while the manifest holds"""
+    if _resources_of(Dataset) is None:
+        return Dataset
+    if not _manifest_valid(_manifest_path(root, Dataset)):
+        return Dataset
+
+    cls = _dataset_class(Dataset)
+    checked = type(
+        cls.__name__,
+        (cls,),
+        {"__module__": cls.__module__, "_check_integrity": lambda self: True},
+    )
+    if isinstance(Dataset, partial):
+        return partial(checked, *Dataset.args, **Dataset.keywords)
+    return checked
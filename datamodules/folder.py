@@ -0,0 +1,289 @@
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import os
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import Dataset
+
+from .base import DataModuleBase
+from .cache import CACHE_MODES, TensorCacheDataset, _save_atomic, apply_transform
+from .split import cached_split
+
+__all__ = [
+    "ImageFolderDataModule",
+    "ImageFileDataset",
+    "find_images",
+    "decode_image",
+    "build_thumbnail_cache",
+]
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+# bump whenever `build_thumbnail_cache` output changes
+THUMBNAIL_VERSION = 1
+
+# (color, grayscale) imread flags per JPEG DCT scale factor
+_REDUCED_FLAGS = {
+    1: (cv2.IMREAD_COLOR, cv2.IMREAD_GRAYSCALE),
+    2: (cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    4: (cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    8: (cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+}
+
+
+def find_images(
+    root: str,
+    classes: Optional[List[str]] = None,
+) -> Tuple[List[str], np.ndarray, List[str]]:
+    """Sorted image paths, targets and class names of `root/<class>/*`"""
+    if classes is None:
+        classes = sorted(e.name for e in os.scandir(root) if e.is_dir())
+    class_to_idx = {name: i for i, name in enumerate(classes)}
+
+    paths, targets = [], []
+    for name in sorted(os.listdir(root)):
+        if name not in class_to_idx or not os.path.isdir(os.path.join(root, name)):
+            continue
+        for dir_path, _, file_names in sorted(os.walk(os.path.join(root, name))):
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(dir_path, file_name))
+                    targets.append(class_to_idx[name])
+
+    if not paths:
+        raise FileNotFoundError(f"no images found in {root}/<class>/")
+    return paths, np.asarray(targets, dtype=np.int64), classes
+
+
+def _reduce_factor(data: bytes, size: Tuple[int, int]) -> int:
+    # PIL only parses the header here, no pixel is decoded
+    with Image.open(io.BytesIO(data)) as image:
+        w, h = image.size
+    factor = 1
+    for f in (2, 4, 8):
+        if h // f >= size[0] and w // f >= size[1]:
+            factor = f
+    return factor
+
+
+def decode_image(
+    path: str,
+    size: Optional[Tuple[int, int]] = None,
+    gray: bool = False,
+) -> np.ndarray:
+    """Decode a file to uint8 RGB (HW with `gray`)
+
+    With `size` (h, w) JPEGs are decoded at 1/2, 1/4 or 1/8 scale by the
+    decoder itself as long as the result still covers `size`. The file is
+    read once, the header and the pixels are parsed from the same bytes.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    factor = 1 if size is None else _reduce_factor(data, size)
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), _REDUCED_FLAGS[factor][gray])
+    if image is None:
+        raise IOError(f"cannot decode {path}")
+    if not gray:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+
+def _listing_digest(paths: List[str], root: str) -> str:
+    """changes whenever a file is added, removed, renamed or rewritten"""
+    digest = hashlib.sha1()
+    for path in paths:
+        stat = os.stat(path)
+        rel_path = os.path.relpath(path, root)
+        digest.update(f"{rel_path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()[:12]
+
+
+def build_thumbnail_cache(
+    paths: List[str],
+    image_shape: List[int],
+    cache_path: str,
+    num_threads: Optional[int] = None,
+) -> np.ndarray:
+    """Decode and shrink every image once into a uint8 NHWC `.npy`
+
+    Files are decoded at reduced size on a thread pool (cv2 releases the
+    GIL) and resized to `image_shape` with INTER_AREA. Later runs only
+    memory-map the file.
+    """
+    if not os.path.exists(cache_path):
+        c, h, w = image_shape
+
+        def write(path: str) -> None:
+            images = np.lib.format.open_memmap(
+                path, mode="w+", dtype=np.uint8, shape=(len(paths), h, w, c)
+            )
+
+            def load(i: int) -> None:
+                image = decode_image(paths[i], (h, w), gray=c == 1)
+                image = cv2.resize(image, (w, h), interpolation=cv2.INTER_AREA)
+                images[i] = image if image.ndim == 3 else image[:, :, None]
+
+            with ThreadPoolExecutor(num_threads or os.cpu_count()) as pool:
+                # consume the results so decode errors are raised here
+                for _ in pool.map(load, range(len(paths))):
+                    pass
+            images.flush()
+            del images
+
+        _save_atomic(cache_path, write)
+    return np.load(cache_path, mmap_mode="r")
+
+
+class ImageFileDataset(Dataset):
+    """View of a list of image files with its own transform and index subset
+
+    Files are decoded per sample, reduced in the decoder down to `size`
+    (h, w) when given. Samples reach `transform` as HWC RGB (HW with `gray`)
+    uint8 arrays, like `TensorCacheDataset`.
+    """
+
+    def __init__(
+        self,
+        paths: List[str],
+        targets: Sequence[int],
+        transform: Optional[Callable] = None,
+        indices: Optional[Sequence[int]] = None,
+        size: Optional[Tuple[int, int]] = None,
+        gray: bool = False,
+    ) -> None:
+        targets = np.asarray(targets, dtype=np.int64)
+        self.paths = paths
+        self.indices = None if indices is None else np.asarray(indices)
+        self.targets = targets if indices is None else targets[self.indices]
+        self.transform = transform
+        self.size = size
+        self.gray = gray
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> Tuple[Any, int]:
+        i = index if self.indices is None else self.indices[index]
+        image = decode_image(self.paths[i], self.size, self.gray)
+        image = apply_transform(self.transform, image, int(i))
+        return image, int(self.targets[index])
+
+
+class ImageFolderDataModule(DataModuleBase):
+    """Datamodule over `<root_dir>/train/<class>/*` image folders
+
+    `val_size` of train is held out for validation (stratified, see
+    `cached_split`); `<root_dir>/test/<class>/*` is the test split, or val
+    when there is none. With `cache` the images are shrunk once to
+    `thumbnail_size` (default: the train transforms' size) into
+    `<root_dir>/cache`, `shared` then loads them into shared memory.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        train_transforms: Callable,
+        val_transforms: Callable,
+        test_transforms: Callable,
+        batch_size: int = 256,
+        num_workers: int = 8,
+        thumbnail_size: Optional[int] = None,
+        decode_threads: Optional[int] = None,
+        **kwargs,
+    ):
+        super().__init__(
+            root_dir,
+            train_transforms,
+            val_transforms,
+            test_transforms,
+            batch_size,
+            num_workers,
+            **kwargs,
+        )
+        self.hparams.update(
+            {"thumbnail_size": thumbnail_size, "decode_threads": decode_threads}
+        )
+        if self.hparams.eval_cache:
+            raise ValueError("eval_cache is not supported, use cache (thumbnails)")
+
+    @property
+    def _image_shape(self) -> List[int]:
+        c, h, w = self.train_transforms.image_shape
+        size = self.hparams.thumbnail_size
+        return [c, h, w] if size is None else [c, size, size]
+
+    def _images(self, split: str, paths: List[str]):
+        """thumbnail array with `cache`, the file paths themselves without"""
+        if self.hparams.cache is None:
+            return paths
+
+        c, h, w = image_shape = self._image_shape
+        name = os.path.basename(os.path.normpath(self.hparams.root_dir))
+        digest = _listing_digest(paths, self.hparams.root_dir)
+        file_name = (
+            f"{name}-{split}-{c}x{h}x{w}-v{THUMBNAIL_VERSION}-{digest}-uint8.npy"
+        )
+        images = build_thumbnail_cache(
+            paths,
+            image_shape,
+            os.path.join(self.hparams.root_dir, "cache", file_name),
+            self.hparams.decode_threads,
+        )
+        if self.hparams.cache == "shared":
+            # a copy: the memory map is read-only and file backed
+            return torch.from_numpy(np.array(images)).share_memory_()
+        if self.hparams.cache == "mmap":
+            return images
+        raise ValueError(
+            f"unknown cache mode: {self.hparams.cache}, expected one of {CACHE_MODES}"
+        )
+
+    def _train_images(self, paths: List[str]):
+        # built once for the train, val and val-as-test views, also across
+        # `setup("fit")` and `setup("test")`
+        if getattr(self, "_train_cache", None) is None:
+            self._train_cache = self._images("train", paths)
+        return self._train_cache
+
+    def _view(self, images, targets, transform, indices=None) -> Dataset:
+        if isinstance(images, list):
+            c, h, w = self._image_shape
+            return ImageFileDataset(images, targets, transform, indices, (h, w), c == 1)
+        return TensorCacheDataset(images, targets, transform, indices, True)
+
+    def setup(self, stage: Optional[str] = None) -> None:
+        root_dir = self.hparams.root_dir
+        test_dir = os.path.join(root_dir, "test")
+        paths, targets, self.classes = find_images(os.path.join(root_dir, "train"))
+        name = os.path.basename(os.path.normpath(root_dir))
+        digest = hashlib.sha1(json.dumps(paths).encode()).hexdigest()[:12]
+        train_idx, val_idx = cached_split(
+            targets,
+            f"ImageFolder-{name}-{digest}",
+            root_dir,
+            self.hparams.val_size,
+            self.hparams.seed,
+        )
+
+        if stage == "fit" or stage is None:
+            images = self._train_images(paths)
+            self.train_ds = self._view(
+                images, targets, self.train_transforms, train_idx
+            )
+            self.val_ds = self._view(images, targets, self.val_transforms, val_idx)
+
+        if stage == "test" or stage is None:
+            if os.path.isdir(test_dir):
+                paths, targets, _ = find_images(test_dir, self.classes)
+                images = self._images("test", paths)
+                self.test_ds = self._view(images, targets, self.test_transforms)
+            else:
+                # no test folder, test on the held out val samples
+                self.test_ds = self._view(
+                    self._train_images(paths), targets, self.test_transforms, val_idx
+                )
@@ -0,0 +1,164 @@
+from typing import *
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, Sampler
+
+__all__ = [
+    "SAMPLER_TABLE",
+    "EpochSubsetSampler",
+    "ClassBalancedSampler",
+    "LossImportanceSampler",
+    "IndexedDataset",
+]
+
+
+def _rank_world() -> Tuple[int, int]:
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+class EpochSampler(Sampler):
+    """Draws `num_samples` train indices per epoch, seeded by (seed, epoch)
+
+    Every rank draws the same list and keeps its own `rank::world_size`
+    slice, so the samplers shard themselves under DDP (no
+    `DistributedSampler` on top).
+    """
+
+    # whether batches have to carry sample indices (see `IndexedDataset`)
+    requires_indices = False
+
+    def __init__(
+        self,
+        targets: Sequence[int],
+        num_samples: Optional[int] = None,
+        seed: int = 0,
+    ) -> None:
+        self.targets = np.asarray(targets, dtype=np.int64)
+        self.num_samples = len(self.targets) if num_samples is None else num_samples
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def _draw(self, generator: torch.Generator) -> torch.Tensor:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        _, world_size = _rank_world()
+        return -(-self.num_samples // world_size)
+
+    def __iter__(self) -> Iterator[int]:
+        rank, world_size = _rank_world()
+        seed = np.random.SeedSequence([self.seed, self.epoch]).generate_state(1)
+        generator = torch.Generator().manual_seed(int(seed[0]))
+        indices = self._draw(generator)
+
+        # pad so every rank gets the same number of samples
+        padding = len(self) * world_size - len(indices)
+        indices = torch.cat([indices, indices[:padding]])
+        return iter(indices[rank::world_size].tolist())
+
+
+class EpochSubsetSampler(EpochSampler):
+    """A fresh random subset of `num_samples` every epoch, no repeats
+
+    Beyond the dataset size it keeps drawing from further permutations.
+    """
+
+    def _draw(self, generator: torch.Generator) -> torch.Tensor:
+        num_perms = -(-self.num_samples // len(self.targets))
+        indices = [
+            torch.randperm(len(self.targets), generator=generator)
+            for _ in range(num_perms)
+        ]
+        return torch.cat(indices)[: self.num_samples]
+
+
+class ClassBalancedSampler(EpochSampler):
+    """Every class equally likely, drawn with replacement"""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        counts = np.bincount(self.targets)
+        self.weights = torch.from_numpy(1.0 / counts[self.targets])
+
+    def _draw(self, generator: torch.Generator) -> torch.Tensor:
+        return torch.multinomial(
+            self.weights, self.num_samples, replacement=True, generator=generator
+        )
+
+
+class LossImportanceSampler(EpochSampler):
+    """Samples drawn in proportion to their latest training loss
+
+    Losses come back from `LitBase.training_step` through
+    `record_losses`, kept as an exponential moving average per sample.
+    Samples never seen keep the running maximum so they get visited, and
+    `uniform` of the probability mass is spread evenly so easy samples are
+    still revisited now and then.
+    """
+
+    requires_indices = True
+
+    def __init__(
+        self,
+        *args,
+        momentum: float = 0.9,
+        uniform: float = 0.1,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.momentum = momentum
+        self.uniform = uniform
+        self.losses = torch.full((len(self.targets),), float("nan"))
+
+    def record_losses(self, indices: torch.Tensor, losses: torch.Tensor) -> None:
+        indices = indices.detach().long().cpu()
+        losses = losses.detach().float().cpu()
+        previous = self.losses[indices]
+        self.losses[indices] = torch.where(
+            torch.isnan(previous),
+            losses,
+            self.momentum * previous + (1 - self.momentum) * losses,
+        )
+
+    def _draw(self, generator: torch.Generator) -> torch.Tensor:
+        seen = ~torch.isnan(self.losses)
+        if not seen.any():
+            weights = torch.ones(len(self.losses))
+        else:
+            weights = self.losses.clone()
+            weights[~seen] = self.losses[seen].max()
+            weights = weights.clamp(min=1e-8)
+
+        weights = weights / weights.sum()
+        weights = (1 - self.uniform) * weights + self.uniform / len(weights)
+        return torch.multinomial(
+            weights, self.num_samples, replacement=True, generator=generator
+        )
+
+
+class IndexedDataset(Dataset):
+    """(image, target, index) view of a dataset, for loss bookkeeping"""
+
+    def __init__(self, dataset: Dataset) -> None:
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: int) -> Tuple[Any, int, int]:
+        image, target = self.dataset[index]
+        return image, target, index
+
+
+SAMPLER_TABLE: Dict[str, Type[EpochSampler]] = {
+    "subset": EpochSubsetSampler,
+    "balanced": ClassBalancedSampler,
+    "importance": LossImportanceSampler,
+}
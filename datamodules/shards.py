@@ -0,0 +1,310 @@
+from typing import *
+import glob
+import io
+import itertools
+import json
+import os
+import tarfile
+import zlib
+
+import cv2
+import numpy as np
+import torch
+from pytorch_lightning.utilities import rank_zero_warn
+from torch.utils.data import IterableDataset, get_worker_info
+
+from .base import DataModuleBase
+from .cache import apply_transform
+from .samplers import _rank_world
+
+__all__ = ["ShardDataModule", "ShardDataset", "write_shards"]
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+# number of samples per shard, written next to the shards
+COUNTS_FILE = "counts.json"
+
+
+def write_shards(
+    samples: Iterable[Tuple[np.ndarray, int]],
+    out_dir: str,
+    samples_per_shard: int = 10000,
+    ext: str = ".png",
+) -> List[str]:
+    """Write (uint8 image, label) pairs as WebDataset style tar shards
+
+    Every sample is a `{key}{ext}` encoded image and a `{key}.cls` label.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths, counts, tar = [], {}, None
+
+    def add(name: str, payload: bytes) -> None:
+        info = tarfile.TarInfo(name)
+        info.size = len(payload)
+        tar.addfile(info, io.BytesIO(payload))
+
+    for index, (image, label) in enumerate(samples):
+        if index % samples_per_shard == 0:
+            if tar is not None:
+                tar.close()
+            paths.append(os.path.join(out_dir, f"shard-{len(paths):06d}.tar"))
+            counts[os.path.basename(paths[-1])] = 0
+            tar = tarfile.open(paths[-1], "w")
+
+        image = np.asarray(image)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        key = f"{index:09d}"
+        add(f"{key}{ext}", cv2.imencode(ext, image)[1].tobytes())
+        add(f"{key}.cls", str(int(label)).encode())
+        counts[os.path.basename(paths[-1])] += 1
+
+    if tar is not None:
+        tar.close()
+    with open(os.path.join(out_dir, COUNTS_FILE), "w") as f:
+        json.dump(counts, f)
+    return paths
+
+
+def _decode(payload: bytes) -> np.ndarray:
+    image = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_UNCHANGED)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+
+def _sample_index(key: str) -> int:
+    """stable integer id of a sample key, the key itself when numeric"""
+    name = os.path.basename(key)
+    return int(name) if name.isdigit() else zlib.crc32(key.encode())
+
+
+def _sample(key: str, sample: Dict[str, bytes]) -> Tuple[int, np.ndarray, int]:
+    return _sample_index(key), _decode(sample["image"]), int(sample["cls"])
+
+
+def _iter_raw(path: str) -> Iterator[Tuple[str, Dict[str, bytes]]]:
+    """(key, encoded sample) of a tar shard, read sequentially"""
+    sample: Dict[str, bytes] = {}
+    key = None
+    with tarfile.open(path, "r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name, ext = os.path.splitext(member.name)
+            if name != key:
+                if "image" in sample and "cls" in sample:
+                    yield key, sample
+                sample, key = {}, name
+            payload = tar.extractfile(member).read()
+            if ext.lower() in IMAGE_EXTENSIONS:
+                sample["image"] = payload
+            elif ext == ".cls":
+                sample["cls"] = payload
+    if "image" in sample and "cls" in sample:
+        yield key, sample
+
+
+def _iter_tar(
+    path: str, start: int = 0, stop: Optional[int] = None
+) -> Iterator[Tuple[int, np.ndarray, int]]:
+    """(sample index, image, label) of the [start, stop) samples of a shard
+
+    Samples before `start` are read but not decoded.
+    """
+    for key, sample in itertools.islice(_iter_raw(path), start, stop):
+        yield _sample(key, sample)
+
+
+class ShardDataset(IterableDataset):
+    """Stream samples out of tar shards
+
+    With `shuffle` (train) shards are split across DDP ranks then
+    DataLoader workers, shuffled at shard level every epoch and mixed
+    through an in-memory shuffle buffer. With a `counts.json` next to the
+    shards every rank yields exactly `len(self) // world_size` samples
+    (cycling its shards if needed) so DDP ranks stay in step.
+
+    Without `shuffle` (val/test) every sample is read exactly once: with
+    counts every rank x worker slot reads its own contiguous range of the
+    samples, without them whole shards are dealt out.
+    """
+
+    def __init__(
+        self,
+        shards: List[str],
+        transform: Optional[Callable] = None,
+        shuffle: bool = False,
+        shuffle_buffer: int = 1000,
+        seed: int = 0,
+        counts: Optional[Dict[str, int]] = None,
+    ) -> None:
+        super().__init__()
+        self.shards = sorted(shards)
+        self.transform = transform
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.counts = counts
+        # shared with the workers, advanced by `set_epoch`
+        self.epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch.fill_(epoch)
+
+    def __len__(self) -> int:
+        if self.counts is None:
+            raise TypeError("shard sample counts unknown, no counts.json")
+        return sum(self.counts[os.path.basename(s)] for s in self.shards)
+
+    def _worker_shards(self, rng: np.random.Generator) -> Tuple[List[str], int, int]:
+        rank, world_size = _rank_world()
+        worker = get_worker_info()
+        worker_id, num_workers = (
+            (0, 1) if worker is None else (worker.id, worker.num_workers)
+        )
+
+        shards = list(self.shards)
+        if self.shuffle:
+            shards = [shards[i] for i in rng.permutation(len(shards))]
+
+        parts = world_size * num_workers
+        if self.shuffle and len(shards) < parts:
+            rank_zero_warn(
+                f"{len(shards)} shards for {parts} rank x worker slots, "
+                "some shards are read by several workers"
+            )
+            shards = shards * -(-parts // len(shards))
+        return shards[rank * num_workers + worker_id :: parts], worker_id, num_workers
+
+    def _quota(self, worker_id: int, num_workers: int) -> Optional[int]:
+        """samples this worker yields per epoch, None without counts"""
+        if self.counts is None:
+            return None
+        _, world_size = _rank_world()
+        per_rank = len(self) // world_size
+        return per_rank // num_workers + (worker_id < per_rank % num_workers)
+
+    def _samples(self, shards: List[str], quota: Optional[int]) -> Iterator:
+        count = 0
+        while True:
+            for shard in shards:
+                for sample in _iter_tar(shard):
+                    if quota is not None and count >= quota:
+                        return
+                    count += 1
+                    yield sample
+            # without counts a single pass, with counts cycle up to the quota
+            if quota is None or count == 0:
+                return
+
+    def _range_samples(self, worker_id: int, num_workers: int) -> Iterator:
+        """This slot's contiguous share of the samples, in shard order"""
+        rank, world_size = _rank_world()
+        part, parts = rank * num_workers + worker_id, world_size * num_workers
+        start, stop = len(self) * part // parts, len(self) * (part + 1) // parts
+
+        offset = 0
+        for shard in self.shards:
+            count = self.counts[os.path.basename(shard)]
+            if offset < stop and start < offset + count:
+                yield from _iter_tar(
+                    shard, max(start - offset, 0), min(stop - offset, count)
+                )
+            offset += count
+
+    def __iter__(self) -> Iterator[Tuple[Any, int]]:
+        rng = np.random.default_rng([self.seed, int(self.epoch)])
+        shards, worker_id, num_workers = self._worker_shards(rng)
+        if self.shuffle:
+            samples = self._samples(shards, self._quota(worker_id, num_workers))
+        elif self.counts is not None:
+            samples = self._range_samples(worker_id, num_workers)
+        else:
+            samples = self._samples(shards, None)
+
+        # every worker mixes its own stream differently
+        rng = np.random.default_rng([self.seed, int(self.epoch), worker_id])
+        buffer = []
+        for sample in samples:
+            if not self.shuffle:
+                yield self._apply(sample)
+                continue
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(sample)
+                continue
+            i = rng.integers(len(buffer))
+            buffer[i], sample = sample, buffer[i]
+            yield self._apply(sample)
+
+        rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._apply(sample)
+
+    def _apply(self, sample: Tuple[int, np.ndarray, int]) -> Tuple[Any, int]:
+        index, image, label = sample
+        return apply_transform(self.transform, image, index), label
+
+
+class ShardDataModule(DataModuleBase):
+    """Datamodule over `<root_dir>/{train,val,test}/*.tar` shards
+
+    Samples are WebDataset style `{key}.{jpg,png,...}` + `{key}.cls` pairs,
+    see `write_shards`. Without a `test` directory the val shards are used
+    for testing.
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        train_transforms: Callable,
+        val_transforms: Callable,
+        test_transforms: Callable,
+        batch_size: int = 256,
+        num_workers: int = 8,
+        shuffle_buffer: int = 1000,
+        **kwargs,
+    ):
+        super().__init__(
+            root_dir,
+            train_transforms,
+            val_transforms,
+            test_transforms,
+            batch_size,
+            num_workers,
+            **kwargs,
+        )
+        self.hparams.update({"shuffle_buffer": shuffle_buffer})
+        if self.hparams.cache is not None or self.hparams.eval_cache:
+            raise ValueError("cache/eval_cache are not supported for shards")
+
+    def _dataset(self, split: str, transform: Callable, shuffle: bool):
+        split_dir = os.path.join(self.hparams.root_dir, split)
+        shards = glob.glob(os.path.join(split_dir, "*.tar"))
+        if not shards:
+            raise FileNotFoundError(f"no *.tar shards in {split_dir}")
+
+        counts_path = os.path.join(split_dir, COUNTS_FILE)
+        counts = None
+        if os.path.exists(counts_path):
+            with open(counts_path) as f:
+                counts = json.load(f)
+
+        return ShardDataset(
+            shards,
+            transform,
+            shuffle=shuffle,
+            shuffle_buffer=self.hparams.shuffle_buffer,
+            seed=self.hparams.seed,
+            counts=counts,
+        )
+
+    def setup(self, stage: Optional[str] = None) -> None:
+        if stage == "fit" or stage is None:
+            self.train_ds = self._dataset("train", self.train_transforms, True)
+            self.val_ds = self._dataset("val", self.val_transforms, False)
+
+        if stage == "test" or stage is None:
+            split = "test"
+            if not os.path.isdir(os.path.join(self.hparams.root_dir, split)):
+                split = "val"
+            self.test_ds = self._dataset(split, self.test_transforms, False)
@@ -0,0 +1,76 @@
+from typing import *
+import math
+import os
+
+import numpy as np
+
+from .cache import _save_atomic
+
+__all__ = ["stratified_split", "cached_split"]
+
+
+def stratified_split(
+    targets: Sequence[int],
+    val_size: float,
+    seed: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Seeded stratified train/val split, sorted train and val indices
+
+    `ceil(val_size * N)` samples go to val, every class contributes
+    `floor(n_class * val_size)` and the remainder goes to the classes with
+    the largest fractional parts, like sklearn's `train_test_split`.
+    """
+    targets = np.asarray(targets, dtype=np.int64)
+    num_samples = len(targets)
+    rng = np.random.default_rng(seed)
+
+    # group samples by class, random order inside every class
+    order = rng.permutation(num_samples)
+    order = order[np.argsort(targets[order], kind="stable")]
+
+    counts = np.bincount(targets)
+    exact = counts * val_size
+    num_val = np.floor(exact).astype(np.int64)
+    remainder = math.ceil(val_size * num_samples) - num_val.sum()
+    if remainder > 0:
+        num_val[np.argsort(num_val - exact, kind="stable")[:remainder]] += 1
+
+    # rank of every sample inside its class group
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    sorted_targets = targets[order]
+    rank = np.arange(num_samples) - starts[sorted_targets]
+    is_val = rank < num_val[sorted_targets]
+
+    return np.sort(order[~is_val]), np.sort(order[is_val])
+
+
+def cached_split(
+    targets: Sequence[int],
+    name: str,
+    root_dir: str,
+    val_size: float = 0.2,
+    seed: int = 0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """`stratified_split` computed once per (dataset, seed, val size)
+
+    Indices live in `<root_dir>/cache` as two small `.npy` files and are
+    memory-mapped on later runs. Every DDP rank derives the same split from
+    the same key, no communication needed.
+    """
+    num_samples = len(targets)
+    prefix = os.path.join(
+        root_dir,
+        "cache",
+        f"{name}-split-n{num_samples}-val{val_size}-seed{seed}",
+    )
+    train_path, val_path = f"{prefix}-train.npy", f"{prefix}-val.npy"
+
+    if not (os.path.exists(train_path) and os.path.exists(val_path)):
+        train_idx, val_idx = stratified_split(targets, val_size, seed)
+        _save_atomic(train_path, lambda path: np.save(path, train_idx))
+        _save_atomic(val_path, lambda path: np.save(path, val_idx))
+
+    return (
+        np.load(train_path, mmap_mode="r"),
+        np.load(val_path, mmap_mode="r"),
+    )
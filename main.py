@@ -14,6 +14,7 @@ from pytorch_lightning.callbacks import (
 from pytorch_lightning.loggers import WandbLogger
 from pytorch_lightning.utilities.seed import seed_everything
 
+from callbacks import *
 from datamodules import *
 from models import *
 from transforms import *
@@ -42,12 +43,32 @@ def hyperparameters():
     add("--image_channels", type=int, default=3)
     add("--image_size", type=int)
     add("--batch_size", type=int, default=64)
+    add("--cache", type=str, choices=CACHE_MODES, default=None)
+    add("--eval_cache", action="store_true")
+    add("--pin_memory", action="store_true")
+    add("--no_persistent_workers", dest="persistent_workers", action="store_false")
+    add("--prefetch_factor", type=int, default=2)
+    add("--autotune_loader", action="store_true")
+    add("--sampler", type=str, choices=list(SAMPLER_TABLE.keys()), default=None)
+    add("--samples_per_epoch", type=int, default=None)
+    add("--shared_collate", action="store_true")
+    add("--uint8_transport", action="store_true")
+    add("--dataset_mirror", type=str, default=None)
+    add("--auto_batch_size", action="store_true")
+    add("--memory_budget_gb", type=float, default=None)
 
     ## each model
     add("--model", type=str, choices=model_candidate)
     add("--model_type", type=str)
     add("--num_classes", type=int)
     add("--dropout_rate", type=float, default=0.5)
+    add("--tta_views", type=int, default=1)
+    add("--label_smoothing", type=float, default=0.0)
+    add("--mixup_alpha", type=float, default=0.0)
+    add("--cutmix_alpha", type=float, default=0.0)
+    add("--train_metrics_every", type=int, default=1)
+    add("--train_log_every", type=int, default=1)
+    add("--checkpoint_segments", type=int, default=0)
 
     ## WideResNet
     add("--depth", type=int, default=40)
@@ -68,6 +89,7 @@ def hyperparameters():
     add("--callbacks_mode", type=str, default="max")
     add("--earlystooping_min_delta", type=float, default=0.02)
     add("--earlystooping_patience", type=int, default=10)
+    add("--progressive_resize", type=str, nargs="+", default=None)
 
     ## optimizer
     add("--lr", type=float, default=0.1)
@@ -87,22 +109,74 @@ def hyperparameters():
     add("--nesterov", action="store_true")
 
     args = pl.Trainer.parse_argparser(parser.parse_args())
+    if args.sampler == "importance" and (args.mixup_alpha or args.cutmix_alpha):
+        # the recorded losses are of the mixed images, not of the samples
+        parser.error("--sampler importance cannot be used with mixup/cutmix")
     return args
 
 
-def main(args):
+def build_transforms(args, image_shape: List[int]) -> Tuple[Any, Any, Any]:
     transforms = TRANSFORMS_TABLE[args.transforms]
+    # uint8 samples out of the workers, normalized per batch by the model
+    kwargs = {"uint8": True} if args.uint8_transport else {}
+    return (
+        transforms(image_shape=image_shape, train=True, **kwargs),
+        transforms(image_shape=image_shape, train=False, **kwargs),
+        transforms(image_shape=image_shape, train=False, **kwargs),
+    )
+
+
+def main(args):
     datamodule = DATAMODULE_TABLE[args.dataset]
     model = MODEL_TABLE[args.model]
 
     seed_everything(args.seed)
 
+    ############################## MODEL ####################################
+    model = model(args)
+    model.initialize_weights()
+    if args.checkpoint_segments:
+        # trade recompute in backward for the activations of deep stages
+        model.checkpoint_stages(args.checkpoint_segments)
+
     ######################### BUILD DATAMODULE ##############################
     image_shape = [args.image_channels, args.image_size, args.image_size]
 
-    train_transforms = transforms(image_shape=image_shape, train=True)
-    val_transforms = transforms(image_shape=image_shape, train=False)
-    test_transforms = transforms(image_shape=image_shape, train=False)
+    if args.auto_batch_size:
+        # `--batch_size` becomes the effective batch: the largest per step
+        # batch within `--memory_budget_gb`, gradient accumulation for the rest
+        image_size = args.image_size
+        if args.progressive_resize:
+            image_size = max(
+                image_size, *parse_schedule(args.progressive_resize).values()
+            )
+        # the device the trainer will pick: `--gpus N` or `--accelerator gpu`
+        # (`auto` takes a GPU when there is one); `--accelerator cpu` wins
+        accelerator = getattr(args, "accelerator", None)
+        use_gpu = (
+            torch.cuda.is_available()
+            and accelerator != "cpu"
+            and (
+                accelerator in ["gpu", "cuda", "auto"]
+                or args.gpus not in [None, 0, "0"]
+            )
+        )
+        record = auto_batch_size(
+            model,
+            [args.image_channels, image_size, image_size],
+            args.batch_size,
+            path=os.path.join(
+                args.default_root_dir, args.experiment_name, "batch_size.json"
+            ),
+            budget_gb=args.memory_budget_gb,
+            device="cuda" if use_gpu else "cpu",
+        )
+        args.batch_size = record["batch_size"]
+        args.accumulate_grad_batches = record["accumulate_grad_batches"]
+
+    train_transforms, val_transforms, test_transforms = build_transforms(
+        args, image_shape
+    )
 
     datamodule = datamodule(
         root_dir=args.root_dir,
@@ -111,11 +185,18 @@ def main(args):
         test_transforms=test_transforms,
         batch_size=args.batch_size,
         num_workers=args.num_workers,
+        cache=args.cache,
+        eval_cache=args.eval_cache,
+        pin_memory=args.pin_memory,
+        persistent_workers=args.persistent_workers,
+        prefetch_factor=args.prefetch_factor,
+        autotune=args.autotune_loader,
+        seed=args.seed,
+        sampler=args.sampler,
+        samples_per_epoch=args.samples_per_epoch,
+        shared_collate=args.shared_collate,
+        mirror=args.dataset_mirror,
     )
-    ############################## MODEL ####################################
-    model = model(args)
-    model.initialize_weights()
-
     ############################## LOGGER ###################################
     save_dir = os.path.join(
         args.default_root_dir,
@@ -133,7 +214,7 @@ def main(args):
 
     ############################## CALLBACKS ################################
     callbacks = [
-        TQDMProgressBar(refresh_rate=5),
+        TQDMProgressBar(refresh_rate=args.callbacks_refresh_rate),
         LearningRateMonitor(logging_interval="epoch"),
         EarlyStopping(
             monitor=args.callbacks_monitor,
@@ -153,12 +234,18 @@ def main(args):
             verbose=args.callbacks_verbose,
         ),
     ]
+    if args.progressive_resize:
+        # e.g. 0:128 4:160 8:224, epoch:image_size of the train transforms
+        schedule = parse_schedule(args.progressive_resize)
+        callbacks.append(ProgressiveResize(schedule))
 
     ############################## TRAIN SETTING ############################
     trainer = pl.Trainer.from_argparse_args(
         args,
         logger=wandb_logger,
         callbacks=callbacks,
+        # the samplers shard themselves across DDP ranks
+        replace_sampler_ddp=args.replace_sampler_ddp and args.sampler is None,
     )
 
     ############################# TRAIN START ###############################
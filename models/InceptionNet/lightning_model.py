@@ -2,7 +2,6 @@ from typing import *
 
 import torch.nn as nn
 import torch.optim as optim
-from torchmetrics import functional as tmf
 
 from models.LitBase import LitBase
 
@@ -42,21 +41,16 @@ class LitInceptionV3(LitBase):
         }
 
     def training_step(self, batch, batch_idx: int) -> Tensor:
-        x, y = batch
+        x, y, target = self._mix_batch(batch)
         logit, aux_logits = self(x)
+        self._record_losses(batch, logit)
 
-        aux_loss = self.loss(aux_logits, y)
-        main_loss = self.loss(logit, y)
+        aux_loss = self._train_loss(aux_logits, y, target)
+        main_loss = self._train_loss(logit, y, target)
 
         loss = main_loss * self.hparams.loss_w + aux_loss * self.hparams.aux_loss_w
-        self.log_dict(
-            {
-                "train/loss": loss,
-                "train/acc": tmf.accuracy(logit, y),
-                "train/acc_top_3": tmf.accuracy(logit, y, top_k=3),
-                "train/acc_top_5": tmf.accuracy(logit, y, top_k=5),
-            },
-            prog_bar=True,
+        self._log_train(
+            {"train/loss": loss, **self._train_metrics(logit, y, batch_idx)}
         )
 
         return loss
@@ -0,0 +1,100 @@
+from typing import *
+import inspect
+
+import torch
+import torch.nn as nn
+from torch import Tensor
+from torch.utils.checkpoint import checkpoint
+
+__all__ = ["CheckpointedSequential", "checkpoint_stages"]
+
+# torch >= 1.11 takes `use_reentrant`, the non-reentrant variant also
+# backpropagates into stages whose input does not require grad
+_CHECKPOINT_KWARGS = (
+    {"use_reentrant": False}
+    if "use_reentrant" in inspect.signature(checkpoint).parameters
+    else {}
+)
+
+
+def _run(modules: Sequence[nn.Module]) -> Callable[[Tensor], Tensor]:
+    calls = 0
+
+    def forward(x: Tensor) -> Tensor:
+        nonlocal calls
+        calls += 1
+        # the backward recompute (possibly stopped early) leaves the
+        # buffers, BatchNorm running stats, as the forward left them
+        buffers = [b for m in modules for b in m.buffers()]
+        saved = [b.clone() for b in buffers] if calls > 1 else []
+        try:
+            for module in modules:
+                x = module(x)
+        finally:
+            for buffer, value in zip(buffers, saved):
+                buffer.copy_(value)
+        return x
+
+    return forward
+
+
+class CheckpointedSequential(nn.Sequential):
+    """`nn.Sequential` keeping only the inputs of its `segments` while training
+
+    The blocks are split into `segments` contiguous runs; the activations
+    inside a run are recomputed in backward instead of being kept. Eval and
+    no-grad forwards are plain. Parameter names are the ones of the
+    `nn.Sequential`.
+    """
+
+    def __init__(self, segments: int, *modules: nn.Module) -> None:
+        super().__init__(*modules)
+        self.segments = segments
+
+    def runs(self) -> List[List[nn.Module]]:
+        """The blocks split into (at most) `segments` contiguous runs"""
+        modules = list(self)
+        size = -(-len(modules) // min(max(self.segments, 1), len(modules)))
+        return [modules[start : start + size] for start in range(0, len(modules), size)]
+
+    def forward(self, x: Tensor) -> Tensor:
+        # `segments` 0: plain, e.g. while a memory probe inspects the runs
+        if not (self.segments and self.training and torch.is_grad_enabled()):
+            return super().forward(x)
+        for run in self.runs():
+            x = checkpoint(_run(run), x, **_CHECKPOINT_KWARGS)
+        return x
+
+
+def _is_stage(module: nn.Module) -> bool:
+    # repeated blocks: 2+ children of one (non-leaf, non-container) type,
+    # e.g. ResidualBlock's BottleNeckBlocks or DenseBlock's BottleNeckBlocks
+    if not isinstance(module, nn.Sequential) or len(module) < 2:
+        return False
+    kinds = {type(child) for child in module}
+    kind = next(iter(kinds))
+    return (
+        len(kinds) == 1
+        and not issubclass(kind, nn.Sequential)
+        and any(True for _ in module[0].children())
+    )
+
+
+def checkpoint_stages(model: nn.Module, segments: int) -> int:
+    """Checkpoint every stage of repeated blocks of `model` in place
+
+    Stages are the `nn.Sequential`s of same-type blocks (`_is_stage`), at
+    most `segments` activation checkpoints each. Returns the number of
+    stages checkpointed.
+    """
+    count = 0
+    for name, child in list(model.named_children()):
+        if isinstance(child, CheckpointedSequential):
+            child.segments = segments
+            count += 1
+        elif _is_stage(child):
+            setattr(model, name, CheckpointedSequential(segments, *child))
+            count += 1
+        else:
+            count += checkpoint_stages(child, segments)
+    return count
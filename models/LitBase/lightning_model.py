@@ -1,13 +1,21 @@
 from typing import *
 from abc import ABCMeta, abstractmethod
+import time
 
 import pytorch_lightning as pl
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch import Tensor
-from torchmetrics import functional as tmf
+
+from transforms.tta import tta_views
+
+from .checkpointing import checkpoint_stages
+from .mixing import cutmix_, mixup_, soft_cross_entropy, soft_targets
 
 _batch_type = Tuple[Tensor, Tensor]
+# top-k accuracies reported for val/test
+_TOP_K = (1, 3, 5)
 
 
 class LitBase(pl.LightningModule, metaclass=ABCMeta):
@@ -30,50 +38,213 @@ class LitBase(pl.LightningModule, metaclass=ABCMeta):
                 nn.init.normal_(m.weight, 0, 0.01)
                 nn.init.constant_(m.bias, 0)
 
+    def checkpoint_stages(self, segments: int) -> int:
+        """Activation checkpointing of the model's stages of repeated blocks
+
+        Activations inside a stage are recomputed in backward, at most
+        `segments` checkpoints kept per stage. Returns the number of stages.
+        """
+        return checkpoint_stages(self.model, segments)
+
     def forward(self, x: Tensor) -> Tensor:
         return self.model(x)
 
+    def _stage_transforms(self) -> Optional[Callable]:
+        """Transforms of the datamodule for the running fit/validate/test loop
+
+        None outside of those loops, e.g. for the example inputs of
+        `to_torchscript` / `to_onnx`, which also pass the batch hooks.
+        """
+        try:
+            trainer = self.trainer
+        except RuntimeError:  # not attached
+            return None
+        datamodule = getattr(trainer, "datamodule", None)
+        if datamodule is None:
+            return None
+        if trainer.training:
+            return datamodule.train_transforms
+        if trainer.validating or trainer.sanity_checking:
+            return datamodule.val_transforms
+        if trainer.testing:
+            return datamodule.test_transforms
+        return None
+
+    def _set_data_epoch(self, epoch: int) -> None:
+        # epoch aware datasets (shard shuffling, ...) read it in the workers
+        set_epoch = getattr(self.trainer.datamodule, "set_epoch", None)
+        if set_epoch is not None:
+            set_epoch(epoch)
+
+    def on_train_start(self) -> None:
+        self._set_data_epoch(self.current_epoch)
+        # device side sums of the train metrics, see `_log_train`
+        self._train_sums, self._train_steps = {}, 0
+
+    def on_train_epoch_end(self) -> None:
+        # before the next epoch's loader iterator wakes the workers up
+        self._set_data_epoch(self.current_epoch + 1)
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int) -> Any:
+        # batch level transforms (e.g. BatchTransforms) run on device, on
+        # loader batches only: bare tensors (export example inputs) pass
+        if not isinstance(batch, (tuple, list)):
+            return batch
+        transform_batch = getattr(self._stage_transforms(), "transform_batch", None)
+        if transform_batch is None:
+            return batch
+        x, *rest = batch
+        return (transform_batch(x), *rest)
+
+    def _record_losses(self, batch: Sequence[Tensor], logit: Tensor) -> None:
+        # batches carry sample indices only for loss driven samplers
+        if len(batch) < 3:
+            return
+        _, y, index = batch[:3]
+        losses = F.cross_entropy(logit.detach(), y, reduction="none")
+        # every rank's sampler sees every rank's losses, the draws stay equal
+        self.trainer.datamodule.record_losses(
+            self.all_gather(index).flatten(),
+            self.all_gather(losses).flatten(),
+        )
+
+    def _mix_batch(self, batch: Sequence[Tensor]) -> Tuple[Tensor, Tensor, Any]:
+        """Train inputs, hard labels and soft targets (None when unused)
+
+        `--mixup_alpha` / `--cutmix_alpha` mix the batch with its reverse in
+        place, one of the two per batch when both are set, and
+        `--label_smoothing` smooths the targets. Metrics use the hard labels.
+        """
+        x, y, *_ = batch
+        mixup = self.hparams.get("mixup_alpha", 0.0)
+        cutmix = self.hparams.get("cutmix_alpha", 0.0)
+        smoothing = self.hparams.get("label_smoothing", 0.0)
+        if not (mixup or cutmix or smoothing):
+            return x, y, None
+
+        target = soft_targets(y, self.hparams.num_classes, smoothing)
+        use_cutmix = cutmix > 0 and (mixup <= 0 or torch.rand(()).item() < 0.5)
+        alpha = cutmix if use_cutmix else mixup
+        if alpha > 0:
+            lam = torch.distributions.Beta(alpha, alpha).sample().item()
+            (cutmix_ if use_cutmix else mixup_)(x, target, lam)
+        return x, y, target
+
+    def _train_loss(self, logit: Tensor, y: Tensor, target: Any) -> Tensor:
+        if target is None:
+            return self.loss(logit, y)
+        return soft_cross_entropy(logit, target)
+
     def _common_step(self, batch: _batch_type) -> _batch_type:
-        x, y = batch
+        x, y, *_ = batch
         logit = self(x)
         return (logit, y)
 
     def training_step(self, batch: _batch_type, batch_idx: int) -> Tensor:
-        logit, y = self._common_step(batch)
-        loss = self.loss(logit, y)
-        self.log_dict(
-            {
-                "train/loss": loss,
-                "train/acc": tmf.accuracy(logit, y),
-                "train/acc_top_3": tmf.accuracy(logit, y, top_k=3),
-                "train/acc_top_5": tmf.accuracy(logit, y, top_k=5),
-            },
-            prog_bar=True,
+        x, y, target = self._mix_batch(batch)
+        logit = self(x)
+        loss = self._train_loss(logit, y, target)
+        self._record_losses(batch, logit)
+        self._log_train(
+            {"train/loss": loss, **self._train_metrics(logit, y, batch_idx)}
         )
         return loss
 
+    def _reset_metrics(self) -> None:
+        # loss sum, top-k hits and sample count, the whole val/test state
+        self._metric_sums = torch.zeros(len(_TOP_K) + 2, device=self.device)
+
+    @staticmethod
+    def _top_k_hits(logit: Tensor, y: Tensor) -> List[Tensor]:
+        """Number of samples with `y` in the top-k, for every k of `_TOP_K`
+
+        One `topk` for all of them, no sort or input checks per k.
+        """
+        k = min(max(_TOP_K), logit.shape[1])
+        # hits of the top-k predictions, cumulated: top-j hits at [j - 1]
+        hits = (logit.detach().topk(k, dim=1).indices == y[:, None]).sum(0)
+        hits = hits.cumsum(0).float()
+        return [hits[min(j, k) - 1] for j in _TOP_K]
+
+    def _update_metrics(self, logit: Tensor, y: Tensor) -> None:
+        logit = logit.detach()
+        top_k = self._top_k_hits(logit, y)
+        loss = self.loss(logit, y) * len(y)
+        count = torch.tensor(float(len(y)), device=logit.device)
+        self._metric_sums += torch.stack([loss, *top_k, count])
+
+    def on_validation_epoch_start(self) -> None:
+        self._reset_metrics()
+
+    def _train_metrics(
+        self, logit: Tensor, y: Tensor, batch_idx: int
+    ) -> Dict[str, Tensor]:
+        """Train accuracies every `--train_metrics_every` steps, else nothing"""
+        if batch_idx % self.hparams.get("train_metrics_every", 1):
+            return {}
+        metric_dict = {}
+        for k, hit in zip(_TOP_K, self._top_k_hits(logit, y)):
+            name = "train/acc" if k == 1 else f"train/acc_top_{k}"
+            metric_dict[name] = hit / len(y)
+        return metric_dict
+
+    def _log_train(self, metrics: Dict[str, Tensor]) -> None:
+        """Log train metrics, averaged over `--train_log_every` steps
+
+        Between flushes the metrics are only summed on their device, so the
+        steps in between make no `log` call: no host sync for the progress
+        bar or the logger. Best set to a multiple of `log_every_n_steps`.
+        """
+        every = self.hparams.get("train_log_every", 1)
+        if every <= 1:
+            self.log_dict(metrics, prog_bar=True)
+            return
+
+        for name, value in metrics.items():
+            total, count = self._train_sums.get(name, (0.0, 0))
+            self._train_sums[name] = (total + value.detach(), count + 1)
+        self._train_steps += 1
+
+        if self._train_steps % every == 0:
+            means = {k: total / count for k, (total, count) in self._train_sums.items()}
+            self._train_sums = {}
+            self.log_dict(means, prog_bar=True)
+
     def validation_step(self, batch, batch_idx):
-        return self._common_step(batch)
+        self._update_metrics(*self._common_step(batch))
+
+    def on_test_epoch_start(self) -> None:
+        self._reset_metrics()
+        self._test_start, self._test_images = time.perf_counter(), 0
 
     def test_step(self, batch, batch_idx):
-        return self._common_step(batch)
+        # `--tta_views` N: N views per image in one forward pass, logits
+        # averaged over the views
+        num_views = self.hparams.get("tta_views", 1)
+        self._test_images += len(batch[0])
+        if num_views <= 1:
+            self._update_metrics(*self._common_step(batch))
+            return
+
+        x, y, *_ = batch
+        logit = self(tta_views(x, num_views))
+        self._update_metrics(logit.view(len(x), num_views, -1).mean(1), y)
 
     def _validation_test_common_epoch_end(
         self,
-        outputs: List[Tuple[Tensor, Tensor]],
+        outputs: List[Any],
         mode: str,
     ) -> Dict[str, Union[Tensor, float]]:
-        # concatnation every loggit, target
-        logits = torch.cat([logit for logit, _ in outputs])
-        targets = torch.cat([target for _, target in outputs])
+        # running sums of every rank, no per-batch outputs are kept
+        sums = self.all_gather(self._metric_sums).view(-1, len(_TOP_K) + 2).sum(0)
+        loss, *hits, count = sums.unbind()
+        count = count.clamp(min=1)
 
         # calcuration metrics
-        metric_dict = {
-            f"{mode}/loss": self.loss(logits, targets),
-            f"{mode}/acc": tmf.accuracy(logits, targets),
-            f"{mode}/acc_top_3": tmf.accuracy(logits, targets, top_k=3),
-            f"{mode}/acc_top_5": tmf.accuracy(logits, targets, top_k=5),
-        }
+        metric_dict = {f"{mode}/loss": loss / count}
+        for k, hit in zip(_TOP_K, hits):
+            name = f"{mode}/acc" if k == 1 else f"{mode}/acc_top_{k}"
+            metric_dict[name] = hit / count
 
         self.log_dict(metric_dict, prog_bar=True)
         return metric_dict
@@ -84,4 +255,10 @@ class LitBase(pl.LightningModule, metaclass=ABCMeta):
         return self._validation_test_common_epoch_end(outputs, "val")
 
     def test_epoch_end(self, outputs: List[Tensor]) -> Dict[str, Union[Tensor, float]]:
-        return self._validation_test_common_epoch_end(outputs, "test")
+        metric_dict = self._validation_test_common_epoch_end(outputs, "test")
+        # to budget the inference cost of `--tta_views`
+        elapsed = time.perf_counter() - self._test_start
+        images_per_sec = self._test_images / elapsed
+        self.log("test/images_per_sec", images_per_sec)
+        metric_dict["test/images_per_sec"] = images_per_sec
+        return metric_dict
@@ -0,0 +1,49 @@
+from typing import *
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+__all__ = ["soft_targets", "soft_cross_entropy", "mixup_", "cutmix_"]
+
+
+def soft_targets(y: Tensor, num_classes: int, smoothing: float = 0.0) -> Tensor:
+    """One-hot [B, num_classes] targets, `smoothing` spread over all classes"""
+    off = smoothing / num_classes
+    target = torch.full((len(y), num_classes), off, device=y.device)
+    return target.scatter_(1, y[:, None], 1.0 - smoothing + off)
+
+
+def soft_cross_entropy(logit: Tensor, target: Tensor) -> Tensor:
+    """Cross entropy against [B, classes] probability targets"""
+    return torch.sum(-target * F.log_softmax(logit, dim=1), dim=1).mean()
+
+
+def _mix_(x: Tensor, lam: float) -> Tensor:
+    # the reversed batch is the only temporary
+    reverse = x.flip(0)
+    return x.mul_(lam).add_(reverse, alpha=1.0 - lam)
+
+
+def mixup_(x: Tensor, target: Tensor, lam: float) -> None:
+    """MixUp with the reversed batch, inputs and targets in place"""
+    _mix_(x, lam)
+    _mix_(target, lam)
+
+
+def cutmix_(x: Tensor, target: Tensor, lam: float) -> None:
+    """CutMix with the reversed batch, inputs and targets in place
+
+    A random box of `1 - lam` of the image area (clipped at the borders) is
+    pasted from the reversed batch; only that box is copied. Targets are
+    mixed by the area actually pasted.
+    """
+    height, width = x.shape[-2:]
+    ratio = (1.0 - lam) ** 0.5
+    h, w = int(height * ratio), int(width * ratio)
+    cy, cx = torch.randint(height, ()).item(), torch.randint(width, ()).item()
+    y0, y1 = max(cy - h // 2, 0), min(cy + h // 2, height)
+    x0, x1 = max(cx - w // 2, 0), min(cx + w // 2, width)
+
+    x[..., y0:y1, x0:x1] = x[..., y0:y1, x0:x1].flip(0)
+    _mix_(target, 1.0 - (y1 - y0) * (x1 - x0) / (height * width))
@@ -0,0 +1,13 @@
+import pytest
+import torch
+
+
+@pytest.fixture(
+    scope="module",
+)
+def batch():
+    generator = torch.Generator().manual_seed(0)
+    return (
+        torch.rand(4, 3, 16, 16, generator=generator),
+        torch.tensor([0, 1, 2, 3]),
+    )
@@ -0,0 +1,46 @@
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from models.LitBase.checkpointing import *
+
+
+class Block(nn.Module):
+    def __init__(self, dim: int) -> None:
+        super().__init__()
+        self.conv = nn.Conv2d(dim, dim, 3, padding=1)
+        self.bn = nn.BatchNorm2d(dim)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x + F.relu(self.bn(self.conv(x)))
+
+
+def test_checkpoint_stages(batch):
+    x, y = batch
+    torch.manual_seed(0)
+    model = nn.Sequential(
+        nn.Conv2d(3, 8, 3),
+        nn.Sequential(*[Block(8) for _ in range(5)]),
+        nn.AdaptiveAvgPool2d(1),
+        nn.Flatten(),
+        nn.Sequential(nn.Dropout(0.5), nn.Linear(8, 4)),
+    )
+    checkpointed = copy.deepcopy(model)
+
+    # the blocks only, not the classifier head
+    assert checkpoint_stages(checkpointed, 2) == 1
+    assert isinstance(checkpointed[1], CheckpointedSequential)
+    assert list(checkpointed.state_dict()) == list(model.state_dict())
+
+    for m in [model, checkpointed]:
+        torch.manual_seed(0)
+        F.cross_entropy(m(x), y).backward()
+    for p, q in zip(model.parameters(), checkpointed.parameters()):
+        assert torch.allclose(p.grad, q.grad, atol=1e-6)
+
+    checkpointed.eval()
+    model.eval()
+    with torch.no_grad():
+        assert torch.allclose(model(x), checkpointed(x), atol=1e-6)
@@ -0,0 +1,55 @@
+import pytest
+import pytorch_lightning as pl
+import torch
+from easydict import EasyDict
+from torch.utils.data import DataLoader, TensorDataset
+
+from models import LitLeNet5
+from transforms import *
+
+IMAGE_SHAPE = [3, 32, 32]
+
+# transforms normalizing uint8 loader batches in `transform_batch`
+TRANSFORMS = {
+    "BATCH": lambda train: BatchTransforms(IMAGE_SHAPE, train=train, seed=0),
+    "BASE_UINT8": lambda train: BaseTransforms(IMAGE_SHAPE, train=train, uint8=True),
+}
+
+
+class DataModule(pl.LightningDataModule):
+    def __init__(self, transforms: str) -> None:
+        super().__init__()
+        self.train_transforms = TRANSFORMS[transforms](True)
+        self.val_transforms = self.test_transforms = TRANSFORMS[transforms](False)
+        generator = torch.Generator().manual_seed(0)
+        self.dataset = TensorDataset(
+            torch.randint(0, 256, [8] + IMAGE_SHAPE, generator=generator).byte(),
+            torch.randint(0, 10, [8], generator=generator),
+        )
+
+    def _loader(self) -> DataLoader:
+        return DataLoader(self.dataset, batch_size=4)
+
+    train_dataloader = val_dataloader = test_dataloader = _loader
+
+
+@pytest.mark.parametrize("transforms", list(TRANSFORMS))
+def test_to_torchscript(tmp_path, transforms):
+    model = LitLeNet5(EasyDict({"image_channels": 3, "num_classes": 10, "lr": 1e-3}))
+    datamodule = DataModule(transforms)
+    trainer = pl.Trainer(
+        default_root_dir=str(tmp_path),
+        max_steps=2,
+        limit_val_batches=1,
+        logger=False,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    trainer.fit(model, datamodule=datamodule)
+    trainer.test(model, datamodule=datamodule, verbose=False)
+
+    # example inputs are no loader batches, no batch transforms on them
+    example_inputs = torch.rand([1] + IMAGE_SHAPE)
+    script = model.to_torchscript(method="trace", example_inputs=example_inputs)
+    assert torch.allclose(script(example_inputs), model.eval()(example_inputs))
@@ -0,0 +1,84 @@
+import pytest
+import pytorch_lightning as pl
+import torch
+import torch.nn.functional as F
+from easydict import EasyDict
+from torch.utils.data import DataLoader, TensorDataset
+from torchmetrics import functional as tmf
+
+from models import LitLeNet5
+from models.LitBase.lightning_model import _TOP_K, LitBase
+
+
+def _model(**hparams) -> LitLeNet5:
+    args = {"image_channels": 3, "num_classes": 10, "lr": 1e-3, **hparams}
+    return LitLeNet5(EasyDict(args))
+
+
+@pytest.mark.parametrize("num_classes", [2, 4, 5, 10])
+def test_top_k_hits(num_classes):
+    generator = torch.Generator().manual_seed(0)
+    logit = torch.randn(64, num_classes, generator=generator)
+    y = torch.randint(0, num_classes, (64,), generator=generator)
+
+    for k, hits in zip(_TOP_K, LitBase._top_k_hits(logit, y)):
+        # tmf only takes k < num_classes, every label is in a larger top-k
+        expected = tmf.accuracy(logit, y, top_k=k) if k < num_classes else 1.0
+        assert torch.isclose(hits / len(y), torch.tensor(float(expected)))
+
+
+def test_train_metrics_every():
+    model = _model(train_metrics_every=3)
+    logit, y = torch.randn(8, 10), torch.randint(0, 10, (8,))
+
+    logged = [bool(model._train_metrics(logit, y, i)) for i in range(7)]
+    assert logged == [True, False, False, True, False, False, True]
+    metrics = model._train_metrics(logit, y, 0)
+    assert set(metrics) == {"train/acc", "train/acc_top_3", "train/acc_top_5"}
+    assert torch.isclose(metrics["train/acc"], tmf.accuracy(logit, y))
+
+
+def test_validation_running_sums(tmp_path):
+    # uneven batches: 4, 4, 2 samples, the means are per sample
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand(10, 3, 32, 32, generator=generator)
+    y = torch.randint(0, 10, (10,), generator=generator)
+    loader = DataLoader(TensorDataset(x, y), batch_size=4)
+
+    model = _model()
+    trainer = pl.Trainer(
+        default_root_dir=str(tmp_path),
+        logger=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    (metrics,) = trainer.validate(model, dataloaders=loader, verbose=False)
+
+    with torch.no_grad():
+        logit = model.eval()(x)
+    assert metrics["val/loss"] == pytest.approx(F.cross_entropy(logit, y).item())
+    for k in _TOP_K:
+        name = "val/acc" if k == 1 else f"val/acc_top_{k}"
+        expected = tmf.accuracy(logit, y, top_k=k).item()
+        assert metrics[name] == pytest.approx(expected)
+
+
+def test_log_train_every():
+    model = _model(train_log_every=3)
+    model._train_sums, model._train_steps = {}, 0
+    logged = []
+    model.log_dict = lambda metrics, **kwargs: logged.append(metrics)
+
+    losses = [torch.tensor(float(i)) for i in range(7)]
+    for step, loss in enumerate(losses):
+        metrics = {"train/loss": loss}
+        if step % 2 == 0:  # e.g. `--train_metrics_every 2`
+            metrics["train/acc"] = loss / 10
+        model._log_train(metrics)
+
+    # flushed every 3 steps with the means since the last flush
+    assert len(logged) == 2
+    assert logged[0]["train/loss"] == pytest.approx(1.0)
+    assert logged[0]["train/acc"] == pytest.approx(0.1)
+    assert logged[1]["train/loss"] == pytest.approx(4.0)
+    assert logged[1]["train/acc"] == pytest.approx(0.4)
@@ -0,0 +1,39 @@
+import torch
+import torch.nn.functional as F
+
+from models.LitBase.mixing import *
+
+
+def test_soft_cross_entropy(batch):
+    _, y = batch
+    logit = torch.randn(len(y), 5)
+    target = soft_targets(y, 5)
+    assert torch.allclose(soft_cross_entropy(logit, target), F.cross_entropy(logit, y))
+
+    target = soft_targets(y, 5, smoothing=0.1)
+    assert torch.allclose(target.sum(1), torch.ones(len(y)))
+    assert torch.allclose(
+        soft_cross_entropy(logit, target),
+        F.cross_entropy(logit, y, label_smoothing=0.1),
+    )
+
+
+def test_mixup(batch):
+    x, y = batch
+    mixed, target = x.clone(), soft_targets(y, 5)
+    mixup_(mixed, target, 0.7)
+
+    assert torch.allclose(mixed, 0.7 * x + 0.3 * x.flip(0))
+    assert torch.allclose(target[0, [0, 3]], torch.tensor([0.7, 0.3]))
+
+
+def test_cutmix(batch):
+    x, y = batch
+    mixed, target = x.clone(), soft_targets(y, 5)
+    torch.manual_seed(0)
+    cutmix_(mixed, target, 0.6)
+
+    pasted = (mixed != x).any(1)[0].float().mean()
+    assert 0 < pasted < 1
+    assert torch.allclose(target[0, 3], pasted)
+    assert torch.allclose(target.sum(1), torch.ones(len(y)))
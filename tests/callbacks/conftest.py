@@ -0,0 +1,6 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def schedule():
+    return ["0:128", "4:160", "8:224"]
@@ -0,0 +1,85 @@
+import json
+
+import torch
+import torch.nn as nn
+
+from callbacks import *
+from callbacks.batch_size import _step_bytes
+from models.LitBase.checkpointing import checkpoint_stages
+
+
+def test_progressive_resize(schedule):
+    callback = ProgressiveResize(parse_schedule(schedule))
+
+    sizes = [callback.image_size(epoch) for epoch in range(10)]
+    assert sizes == [128] * 4 + [160] * 4 + [224] * 2
+
+    callback = ProgressiveResize({2: 64})
+    assert callback.image_size(0) is None
+    assert callback.image_size(5) == 64
+
+
+def test_auto_batch_size(tmp_path):
+    torch.manual_seed(0)
+    model = nn.Sequential(nn.Conv2d(3, 8, 3), nn.BatchNorm2d(8), nn.ReLU())
+    one = _step_bytes(model, torch.rand(1, 3, 16, 16))
+    per_sample = _step_bytes(model, torch.rand(2, 3, 16, 16)) - one
+
+    # room for exactly 10 samples
+    budget = one + 9.5 * per_sample
+    state = {k: v.clone() for k, v in model.state_dict().items()}
+    assert probe_batch_size(model, [3, 16, 16], 64, budget) == 10
+    assert probe_batch_size(model, [3, 16, 16], 4, budget) == 4
+    assert all(torch.equal(v, state[k]) for k, v in model.state_dict().items())
+
+    assert plan_batch_size(256, 100) == (64, 4)
+    assert plan_batch_size(257, 100) == (86, 3)
+    assert plan_batch_size(64, 64) == (64, 1)
+    assert plan_batch_size(48, 10) == (8, 6)
+
+    path = str(tmp_path / "batch_size.json")
+    budget_gb = budget / 1024**3
+    record = auto_batch_size(model, [3, 16, 16], 32, path, budget_gb)
+    assert (record["batch_size"], record["accumulate_grad_batches"]) == (8, 4)
+    # reused as long as the setup matches
+    record["batch_size"] = -1
+    with open(path, "w") as f:
+        json.dump(record, f)
+    assert auto_batch_size(model, [3, 16, 16], 32, path, budget_gb)["batch_size"] == -1
+    record = auto_batch_size(model, [3, 16, 16], 48, path, budget_gb)
+    assert (record["batch_size"], record["accumulate_grad_batches"]) == (8, 6)
+    assert record["effective_batch_size"] == 48
+
+
+class Block(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.conv1 = nn.Conv2d(8, 8, 3, padding=1)
+        self.conv2 = nn.Conv2d(8, 8, 3, padding=1)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.relu(self.conv2(torch.relu(self.conv1(x))))
+
+
+def test_checkpointed_step_bytes(tmp_path):
+    torch.manual_seed(0)
+    model = nn.Sequential(
+        nn.Conv2d(3, 8, 3), nn.Sequential(*[Block() for _ in range(4)]), nn.Flatten()
+    )
+    x = torch.rand(4, 3, 16, 16)
+    plain = _step_bytes(model, x)
+    path = str(tmp_path / "batch_size.json")
+    record = auto_batch_size(model, [3, 16, 16], 8, path, plain / 1024**3)
+
+    # one segment recomputes the whole stage at once: no saving
+    assert checkpoint_stages(model, 1) == 1
+    assert _step_bytes(model, x) >= plain
+    checkpoint_stages(model, 4)
+    assert _step_bytes(model, x) < plain
+
+    # the plain record is not reused with checkpointing
+    record["batch_size"] = -1
+    with open(path, "w") as f:
+        json.dump(record, f)
+    record = auto_batch_size(model, [3, 16, 16], 8, path, plain / 1024**3)
+    assert record["batch_size"] > 0
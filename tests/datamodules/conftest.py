@@ -42,15 +42,24 @@ def train_transforms(config):
         CIFAR100DataModule,
     ],
 )
-def datamodule(request, config, train_transforms):
-    dm = request.param(
-        root_dir=config.root_dir,
-        train_transforms=train_transforms,
-        val_transforms=train_transforms,
-        test_transforms=train_transforms,
-        batch_size=config.batch_size,
-        num_workers=1,
-    )
-    dm.prepare_data()
-    dm.setup("fit")
-    return dm
+def build_datamodule(request, config, train_transforms):
+    def build(**kwargs):
+        kwargs.setdefault("num_workers", 1)
+        dm = request.param(
+            root_dir=config.root_dir,
+            train_transforms=train_transforms,
+            val_transforms=train_transforms,
+            test_transforms=train_transforms,
+            batch_size=config.batch_size,
+            **kwargs,
+        )
+        dm.prepare_data()
+        dm.setup("fit")
+        return dm
+
+    return build
+
+
+@pytest.fixture(scope="module")
+def datamodule(build_datamodule):
+    return build_datamodule()
@@ -0,0 +1,48 @@
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from datamodules.collate import SharedBatchCollate
+
+
+class RandomImages(Dataset):
+    def __len__(self) -> int:
+        return 50
+
+    def __getitem__(self, index: int):
+        generator = torch.Generator().manual_seed(index)
+        return torch.rand(3, 8, 8, generator=generator), index
+
+
+def test_shared_collate():
+    dataset = RandomImages()
+    expected = list(DataLoader(dataset, batch_size=8, num_workers=0))
+
+    for num_workers in [0, 2]:
+        loader = DataLoader(
+            dataset,
+            batch_size=8,
+            num_workers=num_workers,
+            collate_fn=SharedBatchCollate(ring_size=4),
+        )
+        # copies, buffers are only valid for `ring_size` batches
+        batches = [(x.clone(), y) for x, y in loader]
+        assert len(batches) == len(expected)
+        for (x, y), (ex, ey) in zip(batches, expected):
+            assert torch.equal(x, ex) and torch.equal(y, ey)
+        # last batch is smaller
+        assert len(batches[-1][0]) == 2
+
+
+def test_shared_collate_reuses_buffers(monkeypatch):
+    monkeypatch.setattr(
+        "datamodules.collate.get_worker_info", lambda: object(), raising=True
+    )
+    collate = SharedBatchCollate(ring_size=2)
+    dataset = RandomImages()
+    batch = [dataset[i] for i in range(4)]
+
+    first, _ = collate(batch)
+    second, _ = collate(batch)
+    third, _ = collate(batch)
+    assert first.is_shared() and first.data_ptr() != second.data_ptr()
+    assert first.data_ptr() == third.data_ptr()
@@ -1,4 +1,12 @@
+import math
+
+import numpy as np
 import pytest
+import torch
+
+from datamodules import CACHE_MODES
+from datamodules.collate import SharedBatchCollate
+from datamodules.split import stratified_split
 
 
 def test_model_inference(config, datamodule):
@@ -10,3 +18,81 @@ def test_model_inference(config, datamodule):
 
     assert list(image.size()) == image_shape
     assert list(target.size()) == target_shape
+
+
+@pytest.mark.parametrize("cache", CACHE_MODES)
+def test_cached_inference(config, build_datamodule, cache):
+    datamodule = build_datamodule(cache=cache)
+    train_loader = datamodule.train_dataloader()
+    w = h = config.image_size
+    image_shape = [config.batch_size, config.image_channels, w, h]
+    image, target = next(iter(train_loader))
+
+    assert list(image.size()) == image_shape
+    assert list(target.size()) == [config.batch_size]
+
+
+def test_eval_cache_inference(config, build_datamodule):
+    datamodule = build_datamodule(eval_cache=True)
+    val_loader = datamodule.val_dataloader()
+    w = h = config.image_size
+    image_shape = [config.batch_size, config.image_channels, w, h]
+    image, target = next(iter(val_loader))
+    # single channel sources are cached on one channel
+    channels = 3 if type(datamodule).__name__.startswith("CIFAR") else 1
+
+    assert list(image.size()) == image_shape
+    assert list(target.size()) == [config.batch_size]
+    assert datamodule.val_ds.images.shape[-1] == channels
+
+
+def test_autotune_loader(config, build_datamodule):
+    datamodule = build_datamodule(num_workers=2, autotune=True)
+    train_loader = datamodule.train_dataloader()
+    image, target = next(iter(train_loader))
+
+    assert 1 <= train_loader.num_workers <= 2
+    assert list(target.size()) == [config.batch_size]
+
+
+def test_test_split(config, build_datamodule):
+    datamodule = build_datamodule()
+    datamodule.setup("test")
+    expected = datamodule.Dataset(config.root_dir, train=False)
+
+    images = datamodule.test_ds.images
+    assert np.array_equal(np.asarray(images), np.asarray(expected.data))
+    assert np.array_equal(datamodule.test_ds.targets, np.asarray(expected.targets))
+
+    if hasattr(datamodule, "_splits"):
+        # the split is loaded once
+        datamodule.setup("test")
+        assert datamodule.test_ds.images is images
+
+
+@pytest.mark.parametrize("val_size", [0.2, 0.15])
+def test_stratified_split(val_size):
+    rng = np.random.default_rng(0)
+    targets = rng.integers(0, 7, 1000)
+    train_idx, val_idx = stratified_split(targets, val_size, seed=0)
+
+    assert len(val_idx) == math.ceil(val_size * len(targets))
+    assert len(np.intersect1d(train_idx, val_idx)) == 0
+    assert len(train_idx) + len(val_idx) == len(targets)
+    counts, val_counts = np.bincount(targets), np.bincount(targets[val_idx])
+    assert np.all(np.abs(val_counts - counts * val_size) < 1)
+
+    again, _ = stratified_split(targets, val_size, seed=0)
+    other, _ = stratified_split(targets, val_size, seed=1)
+    assert np.array_equal(train_idx, again)
+    assert not np.array_equal(train_idx, other)
+
+
+def test_shared_collate_pin_memory(build_datamodule):
+    # ring buffers are rewritten, batches have to be copied out (pinned)
+    with pytest.raises(ValueError):
+        build_datamodule(shared_collate=True)
+
+    datamodule = build_datamodule(shared_collate=True, pin_memory=True)
+    collate_fn = datamodule.train_dataloader().collate_fn
+    assert isinstance(collate_fn, SharedBatchCollate) == torch.cuda.is_available()
@@ -0,0 +1,141 @@
+import hashlib
+import http.server
+import io
+import os
+import pickle
+import tarfile
+import threading
+
+import numpy as np
+import pytest
+from torchvision.datasets import CIFAR10
+
+from datamodules.download import *
+from datamodules.download import _manifest_valid, _manifest_path
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with single range requests, logs (path, range)"""
+
+    requests = []
+
+    def send_head(self):
+        self.requests.append((self.path, self.headers.get("Range")))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+
+        with open(path, "rb") as f:
+            data = f.read()
+        start, status = 0, 200
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"][len("bytes=") :].rstrip("-"))
+            if start >= len(data):
+                self.send_error(416)
+                return None
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        return io.BytesIO(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    directory = tmp_path / "mirror"
+    directory.mkdir()
+    handler = lambda *args, **kwargs: RangeHandler(
+        *args, directory=str(directory), **kwargs
+    )
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    RangeHandler.requests = []
+    yield directory, f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def _md5(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+
+def test_fetch_resume(server, tmp_path):
+    directory, url = server
+    data = os.urandom(100_000)
+    (directory / "file.bin").write_bytes(data)
+
+    path = tmp_path / "out" / "file.bin"
+    path.parent.mkdir()
+    # half of it left over by an interrupted download
+    (tmp_path / "out" / "file.bin.part").write_bytes(data[:40_000])
+
+    resource = Resource(
+        [f"{url}/missing.bin", f"{url}/file.bin"], str(path), _md5(data)
+    )
+    fetch([resource])
+
+    assert path.read_bytes() == data
+    assert RangeHandler.requests[-1] == ("/file.bin", "bytes=40000-")
+
+
+def _fake_cifar(directory) -> type:
+    """CIFAR10 with a tiny archive, checksums of that archive"""
+    rng = np.random.default_rng(0)
+    members = {}
+    for name in [f"data_batch_{i}" for i in range(1, 6)] + ["test_batch"]:
+        batch = {
+            "data": rng.integers(0, 256, (4, 3072), dtype=np.uint8),
+            "labels": rng.integers(0, 10, 4).tolist(),
+        }
+        members[name] = pickle.dumps(batch)
+    members["batches.meta"] = pickle.dumps({"label_names": [str(i) for i in range(10)]})
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(f"cifar-10-batches-py/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    (directory / CIFAR10.filename).write_bytes(buffer.getvalue())
+
+    checksums = {name: _md5(data) for name, data in members.items()}
+    return type(
+        "CIFAR10",
+        (CIFAR10,),
+        {
+            "url": "http://127.0.0.1:9/unreachable.tar.gz",
+            "tgz_md5": _md5(buffer.getvalue()),
+            "train_list": [
+                [f"data_batch_{i}", checksums[f"data_batch_{i}"]] for i in range(1, 6)
+            ],
+            "test_list": [["test_batch", checksums["test_batch"]]],
+            "meta": {**CIFAR10.meta, "md5": checksums["batches.meta"]},
+        },
+    )
+
+
+def test_materialize(server, tmp_path):
+    directory, url = server
+    Dataset = _fake_cifar(directory)
+    root = str(tmp_path / "data")
+
+    materialize(Dataset, root, mirror=url)
+    assert RangeHandler.requests == [(f"/{CIFAR10.filename}", None)]
+    assert len(verified(Dataset, root)(root, train=True)) == 20
+    assert _manifest_valid(_manifest_path(root, Dataset))
+
+    # later startups: no network, no hashing
+    num_requests = len(RangeHandler.requests)
+    materialize(Dataset, root, mirror=url)
+    assert len(RangeHandler.requests) == num_requests
+    assert verified(Dataset, root) is not Dataset
+
+    # a changed file invalidates the manifest
+    with open(os.path.join(root, "cifar-10-batches-py", "test_batch"), "ab") as f:
+        f.write(b"\0")
+    assert not _manifest_valid(_manifest_path(root, Dataset))
+    assert verified(Dataset, root) is Dataset
@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+from datamodules.folder import ImageFolderDataModule, decode_image
+from transforms import BaseTransforms
+
+
+@pytest.fixture(scope="module")
+def folder_root(tmp_path_factory):
+    root = tmp_path_factory.mktemp("folder")
+    rng = np.random.default_rng(0)
+    for split, num_samples in [("train", 5), ("test", 2)]:
+        for name in ["cat", "dog", "bird"]:
+            (root / split / name).mkdir(parents=True)
+            for i in range(num_samples):
+                image = rng.integers(0, 256, (128, 96, 3), dtype=np.uint8)
+                cv2.imwrite(str(root / split / name / f"{i}.jpg"), image)
+    return root
+
+
+def test_decode_reduced(folder_root):
+    path = str(folder_root / "train" / "cat" / "0.jpg")
+    assert decode_image(path).shape == (128, 96, 3)
+    assert decode_image(path, (32, 24)).shape == (32, 24, 3)
+    assert decode_image(path, (40, 40), gray=True).shape == (64, 48)
+
+
+@pytest.mark.parametrize("cache", [None, "mmap", "shared"])
+def test_folder_datamodule(folder_root, cache):
+    transforms = BaseTransforms(image_shape=[3, 32, 32], train=False)
+    dm = ImageFolderDataModule(
+        root_dir=str(folder_root),
+        train_transforms=transforms,
+        val_transforms=transforms,
+        test_transforms=transforms,
+        batch_size=4,
+        num_workers=0,
+        cache=cache,
+    )
+    dm.setup()
+    image, target = next(iter(dm.train_dataloader()))
+
+    assert list(image.size()) == [4, 3, 32, 32]
+    assert list(target.size()) == [4]
+    assert dm.classes == ["bird", "cat", "dog"]
+    assert len(dm.train_ds) + len(dm.val_ds) == 15
+    assert len(dm.test_ds) == 6
+
+
+def test_folder_shared_train_once(folder_root, tmp_path, recwarn):
+    # no test folder: val-as-test views the one shared train array
+    root = tmp_path / "folder"
+    (root / "train").mkdir(parents=True)
+    for name in ["bird", "cat", "dog"]:
+        (root / "train" / name).symlink_to(folder_root / "train" / name)
+    transforms = BaseTransforms(image_shape=[3, 32, 32], train=False)
+    dm = ImageFolderDataModule(
+        root_dir=str(root),
+        train_transforms=transforms,
+        val_transforms=transforms,
+        test_transforms=transforms,
+        num_workers=0,
+        cache="shared",
+    )
+    dm.setup("fit")
+    dm.setup("test")
+
+    assert dm.test_ds.images is dm.train_ds.images
+    assert dm.train_ds.images.is_shared()
+    assert not [w for w in recwarn if "not writable" in str(w.message)]
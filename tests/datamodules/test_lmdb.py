@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("lmdb")
+
+from datamodules.LMDB import LMDBDataModule, write_lmdb
+from transforms import BaseTransforms
+
+
+@pytest.fixture(scope="module")
+def lmdb_root(tmp_path_factory):
+    root = tmp_path_factory.mktemp("lmdb")
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (30, 16, 16, 3), dtype=np.uint8)
+    samples = [
+        (cv2.imencode(".png", image)[1].tobytes(), i % 3)
+        for i, image in enumerate(images)
+    ]
+    assert write_lmdb(samples, str(root / "train.lmdb"), commit_every=7) == 30
+    return root
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_lmdb_datamodule(lmdb_root, num_workers):
+    transforms = BaseTransforms(image_shape=[3, 32, 32], train=False)
+    dm = LMDBDataModule(
+        root_dir=str(lmdb_root),
+        train_transforms=transforms,
+        val_transforms=transforms,
+        test_transforms=transforms,
+        batch_size=4,
+        num_workers=num_workers,
+        persistent_workers=False,
+    )
+    dm.setup()
+    batches = list(dm.train_dataloader())
+
+    assert list(batches[0][0].size()) == [4, 3, 32, 32]
+    assert sum(len(y) for _, y in batches) == len(dm.train_ds) == 24
+    assert len(dm.test_ds) == len(dm.val_ds) == 6
+    assert np.bincount(dm.val_ds.targets).tolist() == [2, 2, 2]
@@ -0,0 +1,32 @@
+import numpy as np
+import torch
+
+from datamodules.samplers import *
+
+
+def test_subset_sampler():
+    sampler = EpochSubsetSampler(np.arange(100) % 10, num_samples=30, seed=0)
+    first = list(sampler)
+    assert len(first) == len(sampler) == len(set(first)) == 30
+    assert first == list(sampler)
+
+    sampler.set_epoch(1)
+    assert first != list(sampler)
+
+
+def test_balanced_sampler():
+    targets = np.array([0] * 900 + [1] * 100)
+    sampler = ClassBalancedSampler(targets, num_samples=4000, seed=0)
+    counts = np.bincount(targets[list(sampler)])
+    assert abs(counts[0] - counts[1]) < 400
+
+
+def test_importance_sampler():
+    targets = np.zeros(100, dtype=np.int64)
+    sampler = LossImportanceSampler(targets, num_samples=2000, seed=0)
+    losses = torch.full((100,), 0.01)
+    losses[:10] = 10.0
+    sampler.record_losses(torch.arange(100), losses)
+
+    indices = torch.tensor(list(sampler))
+    assert (indices < 10).float().mean() > 0.5
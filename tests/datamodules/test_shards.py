@@ -0,0 +1,74 @@
+import json
+
+import numpy as np
+import pytest
+from torch.utils.data import DataLoader
+
+from datamodules.shards import COUNTS_FILE, ShardDataModule, ShardDataset, write_shards
+from transforms import BaseTransforms
+
+
+@pytest.fixture(scope="module")
+def shard_root(tmp_path_factory):
+    root = tmp_path_factory.mktemp("shards")
+    rng = np.random.default_rng(0)
+    for split, num_samples in [("train", 40), ("val", 12)]:
+        samples = [
+            (rng.integers(0, 256, (16, 16, 3), dtype=np.uint8), i % 4)
+            for i in range(num_samples)
+        ]
+        write_shards(samples, str(root / split), samples_per_shard=8)
+    return root
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_shard_epoch(shard_root, num_workers):
+    ds = ShardDataset(
+        sorted(map(str, (shard_root / "train").glob("*.tar"))),
+        shuffle=True,
+        shuffle_buffer=8,
+    )
+    loader = DataLoader(ds, batch_size=None, num_workers=num_workers)
+
+    def epoch(index):
+        ds.set_epoch(index)
+        return [image.numpy().tobytes() for image, _ in loader]
+
+    first, second = epoch(0), epoch(1)
+    assert len(first) == len(set(first)) == 40
+    assert set(first) == set(second) and first != second
+    assert first == epoch(0)
+
+
+def test_shard_datamodule(shard_root):
+    transforms = BaseTransforms(image_shape=[3, 32, 32], train=False)
+    dm = ShardDataModule(
+        root_dir=str(shard_root),
+        train_transforms=transforms,
+        val_transforms=transforms,
+        test_transforms=transforms,
+        batch_size=4,
+        num_workers=0,
+    )
+    dm.setup("fit")
+    image, target = next(iter(dm.train_dataloader()))
+
+    assert list(image.size()) == [4, 3, 32, 32]
+    assert list(target.size()) == [4]
+    assert len(dm.val_ds) == 12
+
+
+@pytest.mark.parametrize("num_workers", [0, 2, 3])
+@pytest.mark.parametrize("counts", [True, False])
+def test_shard_eval_coverage(tmp_path, num_workers, counts):
+    # uneven shards: 10 / 10 / 5 samples, labels are the sample numbers
+    rng = np.random.default_rng(0)
+    samples = [(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8), i) for i in range(25)]
+    shards = write_shards(samples, str(tmp_path), samples_per_shard=10)
+    with open(tmp_path / COUNTS_FILE) as f:
+        shard_counts = json.load(f) if counts else None
+
+    ds = ShardDataset(shards, counts=shard_counts)
+    loader = DataLoader(ds, batch_size=None, num_workers=num_workers)
+    labels = sorted(label for _, label in loader)
+    assert labels == list(range(25))
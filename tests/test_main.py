@@ -0,0 +1,39 @@
+import sys
+
+import pytest
+import torch
+
+import main
+from transforms import TRANSFORMS_TABLE
+
+
+@pytest.mark.parametrize("transforms", list(TRANSFORMS_TABLE.keys()))
+@pytest.mark.parametrize("uint8_transport", [True, False])
+def test_build_transforms(monkeypatch, transforms, uint8_transport):
+    argv = ["main.py", "--transforms", transforms, "--image_size", "32"]
+    if uint8_transport:
+        argv.append("--uint8_transport")
+    monkeypatch.setattr(sys, "argv", argv)
+    args = main.hyperparameters()
+
+    image_shape = [args.image_channels, args.image_size, args.image_size]
+    train, val, test = main.build_transforms(args, image_shape)
+
+    assert train.train and not val.train and not test.train
+    image = torch.randint(0, 256, (48, 40, 3), dtype=torch.uint8).numpy()
+    x = val(image)
+    if uint8_transport or transforms == "BATCH":
+        assert x.dtype == torch.uint8
+    else:
+        assert x.dtype == torch.float32
+
+
+@pytest.mark.parametrize("mixing", ["--mixup_alpha", "--cutmix_alpha"])
+def test_importance_sampler_mixing(monkeypatch, mixing):
+    argv = ["main.py", "--sampler", "importance", mixing, "0.2"]
+    monkeypatch.setattr(sys, "argv", argv)
+    with pytest.raises(SystemExit):
+        main.hyperparameters()
+
+    monkeypatch.setattr(sys, "argv", argv[:3])
+    assert main.hyperparameters().sampler == "importance"
@@ -0,0 +1,27 @@
+import pytest
+from easydict import EasyDict
+import numpy as np
+
+
+@pytest.fixture(scope="module")
+def config():
+    return EasyDict(
+        {
+            "batch_size": 4,
+            "image_channels": 3,
+            "image_size": 64,
+            "source_size": 32,
+        }
+    )
+
+
+@pytest.fixture(
+    scope="module",
+    params=[1, 3],
+)
+def images(request, config):
+    rng = np.random.default_rng(0)
+    shape = [config.batch_size, config.source_size, config.source_size]
+    if request.param == 3:
+        shape.append(3)
+    return rng.integers(0, 256, shape, dtype=np.uint8)
@@ -0,0 +1,143 @@
+import random
+
+import cv2
+import pytest
+import numpy as np
+import torch
+
+from transforms import *
+
+
+@pytest.mark.parametrize("train", ["train", "test"])
+def test_base_transforms(config, images, train):
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    transforms = BaseTransforms(image_shape=image_shape, train=train)
+    x = transforms(images[0])
+
+    assert list(x.size()) == image_shape
+    assert x.dtype == torch.float32
+
+
+@pytest.mark.parametrize("mean", [None, (0.5, 0.4, 0.3)])
+def test_uint8_transport(config, images, mean):
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    expected = BaseTransforms(image_shape, mean=mean)
+    transforms = BaseTransforms(image_shape, mean=mean, uint8=True)
+    x = torch.stack([transforms(image) for image in images])
+    assert x.dtype == torch.uint8
+
+    x = transforms.transform_batch(x)
+    assert list(x.size()) == [config.batch_size] + image_shape
+    expected = torch.stack([expected(image) for image in images])
+    assert torch.allclose(x, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("train", ["train", "test"])
+def test_batch_transforms(config, images, train):
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    transforms = BatchTransforms(image_shape=image_shape, train=train, seed=0)
+    x = torch.stack([transforms(image) for image in images])
+    assert x.dtype == torch.uint8
+
+    x = transforms.transform_batch(x)
+    assert list(x.size()) == [config.batch_size] + image_shape
+    assert x.dtype == torch.float32
+
+
+def test_batch_transforms_seed(config, images):
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    x = torch.stack([BatchTransforms(image_shape)(image) for image in images])
+    outputs = [
+        BatchTransforms(image_shape, train=True, seed=seed).transform_batch(x)
+        for seed in [0, 0, 1]
+    ]
+
+    assert torch.equal(outputs[0], outputs[1])
+    assert not torch.equal(outputs[0], outputs[2])
+
+
+@pytest.mark.parametrize("Transforms", [BaseTransforms, BatchTransforms])
+def test_resize_split(config, images, Transforms):
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    transforms = Transforms(image_shape=image_shape, train=False)
+    resized = transforms.resize(images[0])
+
+    assert resized.dtype == np.uint8
+    assert resized.shape[:2] == (config.image_size, config.image_size)
+    assert resized.ndim == images.ndim - 1
+    assert torch.equal(transforms.from_resized(resized), transforms(resized))
+
+
+@pytest.mark.parametrize("train", ["train", "test"])
+@pytest.mark.parametrize("mean", [None, (0.5, 0.5, 0.5)])
+def test_gray_fast_path(config, train, mean):
+    image_shape = [3, config.image_size, config.image_size]
+    transforms = BaseTransforms(image_shape=image_shape, train=train, mean=mean)
+    image = np.random.default_rng(0).integers(0, 256, (48, 40), dtype=np.uint8)
+
+    random.seed(0)
+    x = transforms(image)
+    random.seed(0)
+    rgb = transforms.transforms(image=cv2.cvtColor(image, cv2.COLOR_GRAY2RGB))
+
+    assert list(x.size()) == image_shape
+    assert torch.allclose(x, rgb["image"])
+
+
+@pytest.mark.parametrize("Transforms", [BaseTransforms, BatchTransforms])
+def test_set_image_size(config, images, Transforms):
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    transforms = Transforms(image_shape=image_shape, train=True)
+    loader = torch.utils.data.DataLoader(
+        [image for image in images],
+        batch_size=config.batch_size,
+        collate_fn=lambda batch: torch.stack([transforms(x) for x in batch]),
+        num_workers=1,
+        persistent_workers=True,
+    )
+
+    for size in [config.image_size // 2, config.image_size]:
+        transforms.set_image_size(size)
+        x = next(iter(loader))
+        if hasattr(transforms, "transform_batch"):
+            x = transforms.transform_batch(x)
+        assert list(x.shape[-2:]) == [size, size]
+
+
+def test_keyed_augmentation(config, images):
+    from datamodules.cache import TensorCacheDataset
+
+    image_shape = [config.image_channels, config.image_size, config.image_size]
+    transforms = BaseTransforms(image_shape=image_shape, train=True, seed=0)
+    dataset = TensorCacheDataset(
+        images, np.zeros(len(images)), transforms, channels_last=True
+    )
+
+    def epoch(epoch, num_workers):
+        transforms.set_epoch(epoch)
+        loader = torch.utils.data.DataLoader(dataset, num_workers=num_workers)
+        return torch.cat([x for x, _ in loader])
+
+    first = epoch(0, num_workers=0)
+    assert torch.equal(first, epoch(0, num_workers=2))
+    assert not torch.equal(first, epoch(1, num_workers=0))
+
+
+def test_tta_views():
+    x = torch.rand(2, 3, 32, 32)
+    views = tta_views(x, 4).view(2, 4, 3, 32, 32)
+
+    assert torch.allclose(views[:, 0], x, atol=1e-6)
+    assert torch.allclose(views[:, 1], x.flip(-1), atol=1e-6)
+    # center crop of 28 pixels resized back to 32 (the views sample real
+    # neighbours at the crop border, not clamped ones)
+    crop = torch.nn.functional.interpolate(
+        x[:, :, 2:30, 2:30], size=(32, 32), mode="bilinear", align_corners=False
+    )
+    inner = (Ellipsis, slice(1, -1), slice(1, -1))
+    assert torch.allclose(views[:, 2][inner], crop[inner], atol=1e-5)
+    assert torch.allclose(views[:, 3][inner], crop.flip(-1)[inner], atol=1e-5)
+    # every center crop comes before the corner crops
+    centers = [view[1:3] for view in TTA_VIEWS]
+    assert centers[:6] == [(0.0, 0.0)] * 6
+    assert (0.0, 0.0) not in centers[6:]
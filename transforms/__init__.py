@@ -1,11 +1,17 @@
 from .base import *
+from .batch import *
+from .tta import *
 
 
 TRANSFORMS_TABLE: Dict["str", Callable] = {
     "BASE": BaseTransforms,
+    "BATCH": BatchTransforms,
 }
 
 __all__ = [
     "BaseTransforms",
+    "BatchTransforms",
+    "TTA_VIEWS",
+    "tta_views",
     "TRANSFORMS_TABLE",
 ]
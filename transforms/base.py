@@ -1,15 +1,57 @@
 from typing import *
+import random
+
 import albumentations as A
 import numpy as np
 import torch
 from albumentations.pytorch import ToTensorV2 as ToTensor
 from PIL import Image
+from torch.utils.data import get_worker_info
 import cv2
 
+_MASK24, _MASK40, _MASK64 = (1 << 24) - 1, (1 << 40) - 1, (1 << 64) - 1
+
+
+class NormalizeLUT(A.ImageOnlyTransform):
+    """A.Normalize for uint8 images as a per-channel float32 lookup table
+
+    One `cv2.LUT` pass instead of cast, subtract and multiply passes over the
+    (already resized) image.
+    """
+
+    def __init__(
+        self,
+        mean: Tuple[float, ...],
+        std: Tuple[float, ...],
+        max_pixel_value: float = 255.0,
+        always_apply: bool = True,
+        p: float = 1.0,
+    ) -> None:
+        super().__init__(always_apply, p)
+        self.mean = mean
+        self.std = std
+        self.max_pixel_value = max_pixel_value
+
+        values = np.arange(256, dtype=np.float64)[:, None] / max_pixel_value
+        lut = (values - np.array(mean)) / np.array(std)
+        self.lut = lut.astype(np.float32).reshape(1, 256, len(mean))
+
+    def apply(self, image: np.ndarray, **params) -> np.ndarray:
+        if image.dtype != np.uint8:
+            return A.normalize(image, self.mean, self.std, self.max_pixel_value)
+        return cv2.LUT(image, self.lut)
+
+    def get_transform_init_args_names(self) -> Tuple[str, ...]:
+        return ("mean", "std", "max_pixel_value")
+
 
 class BaseTransforms:
     mean = (0.485, 0.456, 0.406)
     std = (0.229, 0.224, 0.225)
+    # bump whenever the output of `resize` changes, invalidates eval caches
+    version = 2
+    # `__call__` takes the sample index, see `datamodules.cache.apply_transform`
+    keyed = True
 
     def __init__(
         self,
@@ -17,39 +59,175 @@ class BaseTransforms:
         train: Union[int, bool, str] = False,
         mean: Tuple[float, float, float] = None,
         std: Tuple[float, float, float] = None,
+        seed: Optional[int] = None,
+        uint8: bool = False,
     ) -> None:
         self.image_shape = image_shape
         c, image_size, _ = image_shape
-        train = True if isinstance(train, str) and train == "train" else False
+        self.train = train == "train" if isinstance(train, str) else bool(train)
 
-        mean = self.mean if mean is None else mean
-        std = self.std if std is None else std
+        self.mean = mean = self.mean if mean is None else mean
+        self.std = std = self.std if std is None else std
 
         assert c == len(mean)
         assert c == len(std)
 
-        self.transforms = A.Compose(
-            [
-                A.RandomResizedCrop(
-                    height=image_size,
-                    width=image_size,
-                    p=1.0 if train else 0.0,
-                ),
-                A.Resize(image_size, image_size),
-                A.HorizontalFlip(p=1.0 if train else 0.0),
-                A.Normalize(
-                    mean=mean,
-                    std=std,
-                    max_pixel_value=255.0,
-                ),
-                ToTensor(),
+        self._normalize = NormalizeLUT(mean=mean, std=std, max_pixel_value=255.0)
+
+        # uint8: samples leave the workers as uint8 CHW (a quarter of the
+        # bytes), `transform_batch` normalizes whole batches on device
+        self.uint8 = uint8
+        mean_, std_ = torch.tensor(mean), torch.tensor(std)
+        self._scale, self._shift = 1.0 / (255.0 * std_), -mean_ / std_
+
+        # single channel inputs: crop/resize one channel, channels are only
+        # made by the final [C, 256] normalize lookup (a view if they match)
+        self._gray_lut = np.ascontiguousarray(self._normalize.lut[0].T)
+        self._gray_expand = len(set(zip(mean, std))) == 1
+
+        # output size, changed between epochs by `set_image_size`; in shared
+        # memory so persistent DataLoader workers rebuild their graph too
+        self._image_size = torch.tensor(image_size).share_memory_()
+        self._build(image_size)
+
+        # train augmentation keyed by (seed, epoch, sample index), see
+        # `__call__`; default seed is `torch.initial_seed()`, i.e. `--seed`
+        self.seed = torch.initial_seed() if seed is None else seed
+        self._epoch = torch.zeros((), dtype=torch.int64).share_memory_()
+
+    def _build(self, image_size: int) -> None:
+        self.image_shape = [self.image_shape[0], image_size, image_size]
+
+        # each graph only holds the ops that actually run
+        if self.train:
+            transforms = [
+                # crop and resize in a single op
+                A.RandomResizedCrop(height=image_size, width=image_size),
+                A.HorizontalFlip(p=0.5),
             ]
-        )
+        else:
+            transforms = [A.Resize(image_size, image_size)]
+
+        finalize = [ToTensor()] if self.uint8 else [self._normalize, ToTensor()]
+        self.transforms = A.Compose(transforms + finalize)
 
-    def __call__(self, image: Union[np.ndarray, Image.Image]) -> torch.Tensor:
+        # the same graph split at the resize, for pre-resized eval caches
+        self._resize = A.Compose(transforms)
+        self._from_resized = A.Compose(finalize)
+
+    def set_image_size(self, image_size: int) -> None:
+        """Output size of every sample from now on, workers included"""
+        self._image_size.fill_(image_size)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Epoch part of the augmentation key, workers included"""
+        self._epoch.fill_(epoch)
+
+    def _sync(self) -> None:
+        image_size = int(self._image_size)
+        if image_size != self.image_shape[1]:
+            self._build(image_size)
+
+    def _to_array(self, image: Union[np.ndarray, Image.Image]) -> np.ndarray:
         image = np.array(image)
         if self.image_shape[0] == 3 and len(image.shape) < 3:
             image = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        return image
+
+    def _gray(self, image: Union[np.ndarray, Image.Image]) -> Optional[np.ndarray]:
+        """HW view of a single channel image when `image_shape` wants more"""
+        image = np.asarray(image)
+        if self.image_shape[0] == 1 or (image.ndim == 3 and image.shape[2] != 1):
+            return None
+        return image.reshape(image.shape[:2])
+
+    def _broadcast(self, image: np.ndarray) -> torch.Tensor:
+        """uint8 HW -> normalized float32 [C, H, W] in one lookup
+
+        In uint8 mode the single channel is shipped as it is, `transform_batch`
+        broadcasts it.
+        """
+        if self.uint8:
+            return torch.from_numpy(image)[None]
+        if self._gray_expand:
+            x = torch.from_numpy(cv2.LUT(image, self._gray_lut[0]))
+            return x.expand(self.image_shape[0], *x.shape)
+
+        x = np.empty((len(self._gray_lut), *image.shape), dtype=np.float32)
+        for c, lut in enumerate(self._gray_lut):
+            cv2.LUT(image, lut, dst=x[c])
+        return torch.from_numpy(x)
+
+    def resize(self, image: Union[np.ndarray, Image.Image]) -> np.ndarray:
+        """uint8 HWC (HW from one channel) image at `image_shape`, deterministic
+        in eval mode
+        """
+        self._sync()
+        gray = self._gray(image)
+        if gray is not None:
+            # single channel sources stay HW, `from_resized` broadcasts them
+            return self._resize(image=gray)["image"]
+        return self._resize(image=self._to_array(image))["image"]
 
+    def from_resized(self, image: np.ndarray) -> torch.Tensor:
+        """Rest of the graph for an image returned by `resize`"""
+        gray = self._gray(image)
+        if gray is not None:
+            return self._broadcast(gray)
+        return self._from_resized(image=image)["image"]
+
+    def transform_batch(self, x: torch.Tensor) -> torch.Tensor:
+        """uint8 [B, 1 or C, H, W] -> float32 (x / 255 - mean) / std
+
+        One cast and an in-place multiply-add per batch; float batches pass
+        through.
+        """
+        if x.dtype != torch.uint8:
+            return x
+        scale = self._scale.to(x.device).view(1, -1, 1, 1)
+        shift = self._shift.to(x.device).view(1, -1, 1, 1)
+        out = torch.empty((len(x), len(scale[0]), *x.shape[2:]), device=x.device)
+        # cast and single channel broadcast in one copy
+        out.copy_(x.expand_as(out))
+        return out.mul_(scale).add_(shift)
+
+    def _transform(self, image: Union[np.ndarray, Image.Image]) -> torch.Tensor:
+        self._sync()
+        gray = self._gray(image)
+        if gray is not None:
+            return self._broadcast(self._resize(image=gray)["image"])
+
+        image = self._to_array(image)
         image = self.transforms(image=image)["image"]
         return image
+
+    def __call__(
+        self,
+        image: Union[np.ndarray, Image.Image],
+        index: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Transform one sample
+
+        With the sample `index` the train augmentation only depends on
+        (seed, epoch, index), not on which worker runs it or what it ran
+        before: albumentations draws from `random`, which is reseeded from
+        that key for this call (and restored afterwards outside workers).
+        """
+        if index is None or not self.train:
+            return self._transform(image)
+
+        # (seed, epoch, index) packed into one integer, distinct keys seed
+        # distinct streams
+        key = (self.seed & _MASK64) << 64
+        key |= (int(self._epoch) & _MASK24) << 40 | (int(index) & _MASK40)
+        if get_worker_info() is not None:
+            # a worker owns its `random`, nothing to restore
+            random.seed(key)
+            return self._transform(image)
+
+        state = random.getstate()
+        random.seed(key)
+        try:
+            return self._transform(image)
+        finally:
+            random.setstate(state)
@@ -0,0 +1,182 @@
+from typing import *
+import math
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+__all__ = ["BatchTransforms"]
+
+
+class BatchTransforms:
+    """Crop/resize/flip/normalize on a whole collated uint8 batch
+
+    Called per sample (inside DataLoader workers) it only turns the image into
+    a uint8 CHW tensor. `transform_batch` then runs the BaseTransforms
+    pipeline as vectorized tensor ops, meant to be called from
+    `LitBase.on_after_batch_transfer` on the device the batch lives on.
+
+    Crop/flip parameters are drawn from a generator seeded once with `seed`
+    (default: `torch.initial_seed()`, i.e. `--seed`), so the augmentation of
+    every sample is reproducible for a given run.
+
+    `uint8` is accepted like `BaseTransforms`' (`--uint8_transport`), samples
+    always leave the workers as uint8 here.
+    """
+
+    mean = (0.485, 0.456, 0.406)
+    std = (0.229, 0.224, 0.225)
+    # bump whenever the output of `resize` changes, invalidates eval caches
+    version = 1
+
+    def __init__(
+        self,
+        image_shape: List[int],
+        train: Union[int, bool, str] = False,
+        mean: Tuple[float, float, float] = None,
+        std: Tuple[float, float, float] = None,
+        scale: Tuple[float, float] = (0.08, 1.0),
+        ratio: Tuple[float, float] = (3.0 / 4.0, 4.0 / 3.0),
+        flip_p: float = 0.5,
+        seed: Optional[int] = None,
+        uint8: bool = True,
+    ) -> None:
+        self.image_shape = image_shape
+        self.uint8 = True
+        self.train = train == "train" if isinstance(train, str) else bool(train)
+
+        self.mean = mean = self.mean if mean is None else mean
+        self.std = std = self.std if std is None else std
+
+        assert image_shape[0] == len(mean)
+        assert image_shape[0] == len(std)
+
+        self._mean = torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1)
+        self._std = torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1)
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.ratio = ratio
+        self.flip_p = flip_p
+
+        self.seed = torch.initial_seed() if seed is None else seed
+        self._generator = None
+
+    def set_image_size(self, image_size: int) -> None:
+        """Output size of `transform_batch`, runs in the main process only"""
+        self.image_shape = [self.image_shape[0], image_size, image_size]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # generators don't pickle, a copy restarts the stream from `seed`
+        state = self.__dict__.copy()
+        state["_generator"] = None
+        return state
+
+    @property
+    def generator(self) -> torch.Generator:
+        if self._generator is None:
+            self._generator = torch.Generator().manual_seed(self.seed)
+        return self._generator
+
+    def __call__(self, image: Union[np.ndarray, Image.Image]) -> torch.Tensor:
+        image = np.array(image)
+        if image.ndim < 3:
+            image = image[:, :, None]
+        return torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+
+    def resize(self, image: Union[np.ndarray, Image.Image]) -> np.ndarray:
+        """uint8 HWC image at `image_shape`, the eval resize done once on CPU"""
+        _, size, _ = self.image_shape
+        image = np.array(image)
+        if image.shape[:2] == (size, size):
+            return image
+        return cv2.resize(image, (size, size), interpolation=cv2.INTER_LINEAR)
+
+    def from_resized(self, image: np.ndarray) -> torch.Tensor:
+        return self(image)
+
+    def normalize(self, x: torch.Tensor) -> torch.Tensor:
+        """uint8 [B, C, H, W] -> float32 (x / 255 - mean) / std
+
+        Single channel batches are broadcast to `image_shape[0]` channels.
+        """
+        mean = self._mean.to(x.device)
+        std = self._std.to(x.device)
+        return (x.float() / 255.0 - mean) / std
+
+    def _crop_params(self, batch_size: int, height: int, width: int) -> torch.Tensor:
+        """RandomResizedCrop boxes as [B, 4] (x0, y0, w, h), 10 tries per sample"""
+        g, tries = self.generator, 10
+        area = height * width
+
+        scale = torch.empty(batch_size, tries).uniform_(*self.scale, generator=g)
+        log_ratio = torch.empty(batch_size, tries).uniform_(
+            *self.log_ratio, generator=g
+        )
+        target_area = area * scale
+        aspect = torch.exp(log_ratio)
+        w = torch.sqrt(target_area * aspect).round()
+        h = torch.sqrt(target_area / aspect).round()
+
+        valid = (w > 0) & (h > 0) & (w <= width) & (h <= height)
+        first = torch.where(
+            valid.any(1),
+            valid.float().argmax(1),
+            torch.full((batch_size,), -1, dtype=torch.long),
+        )
+
+        # fallback: central crop with the ratio clamped into range
+        in_ratio = width / height
+        if in_ratio < self.ratio[0]:
+            fw, fh = width, round(width / self.ratio[0])
+        elif in_ratio > self.ratio[1]:
+            fw, fh = round(height * self.ratio[1]), height
+        else:
+            fw, fh = width, height
+
+        rows = torch.arange(batch_size)
+        pick = first.clamp(min=0)
+        w = torch.where(first >= 0, w[rows, pick], torch.tensor(float(fw)))
+        h = torch.where(first >= 0, h[rows, pick], torch.tensor(float(fh)))
+
+        u = torch.rand(batch_size, 2, generator=g)
+        x0 = torch.where(
+            first >= 0, (u[:, 0] * (width - w + 1)).floor(), (width - w) / 2
+        )
+        y0 = torch.where(
+            first >= 0, (u[:, 1] * (height - h + 1)).floor(), (height - h) / 2
+        )
+        return torch.stack([x0, y0, w, h], dim=1)
+
+    def transform_batch(self, x: torch.Tensor) -> torch.Tensor:
+        """uint8 [B, C, H, W] batch -> normalized float32 [B, c, size, size]"""
+        _, size, _ = self.image_shape
+        batch_size, _, height, width = x.shape
+        x = self.normalize(x)
+
+        if not self.train:
+            if (height, width) == (size, size):
+                return x
+            return F.interpolate(
+                x, size=(size, size), mode="bilinear", align_corners=False
+            )
+
+        # crop + resize + flip fused into one affine resampling
+        box = self._crop_params(batch_size, height, width)
+        flip = torch.rand(batch_size, generator=self.generator) < self.flip_p
+        x0, y0, w, h = box.unbind(1)
+
+        theta = torch.zeros(batch_size, 2, 3)
+        theta[:, 0, 0] = torch.where(flip, -w / width, w / width)
+        theta[:, 0, 2] = (2 * x0 + w) / width - 1
+        theta[:, 1, 1] = h / height
+        theta[:, 1, 2] = (2 * y0 + h) / height - 1
+        theta = theta.to(device=x.device, dtype=x.dtype)
+
+        grid = F.affine_grid(
+            theta, [batch_size, x.shape[1], size, size], align_corners=False
+        )
+        return F.grid_sample(
+            x, grid, mode="bilinear", padding_mode="border", align_corners=False
+        )
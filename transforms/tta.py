@@ -0,0 +1,60 @@
+from typing import *
+
+import torch
+import torch.nn.functional as F
+
+__all__ = ["TTA_VIEWS", "tta_views"]
+
+
+def _views() -> List[Tuple[float, float, float, bool]]:
+    # (crop scale, center x, center y, flip), centers in [-1, 1] coordinates:
+    # full image, the 0.875 and 0.75 center crops, then the four corner crops
+    # of each of these scales, every view followed by its flip
+    scales = [1.0, 0.875, 0.75]
+    centers = [(scale, 0.0, 0.0) for scale in scales]
+    for scale in scales[1:]:
+        offset = 1.0 - scale
+        centers += [(scale, x, y) for y in [-offset, offset] for x in [-offset, offset]]
+    return [
+        (scale, cx, cy, flip) for scale, cx, cy in centers for flip in [False, True]
+    ]
+
+
+# deterministic test time views, `tta_views` takes the first N
+TTA_VIEWS = _views()
+
+
+def tta_views(x: torch.Tensor, num_views: int) -> torch.Tensor:
+    """[B, C, H, W] -> [B * num_views, C, H, W], the views of each image adjacent
+
+    Every view (flip and multi-scale crop, resized back to H x W) is one
+    affine resampling, all of them are generated by a single `grid_sample`
+    over the batch, so the model sees them in one forward pass. Reshape its
+    output to [B, num_views, ...] to average per image.
+    """
+    if not 1 <= num_views <= len(TTA_VIEWS):
+        raise ValueError(f"num_views must be in [1, {len(TTA_VIEWS)}]")
+    batch_size, channels, height, width = x.shape
+
+    views = torch.tensor(TTA_VIEWS[:num_views], dtype=x.dtype, device=x.device)
+    scale, cx, cy, flip = views.unbind(1)
+    theta = torch.zeros(num_views, 2, 3, dtype=x.dtype, device=x.device)
+    theta[:, 0, 0] = torch.where(flip > 0, -scale, scale)
+    theta[:, 0, 2] = cx
+    theta[:, 1, 1] = scale
+    theta[:, 1, 2] = cy
+
+    grid = F.affine_grid(
+        theta, [num_views, channels, height, width], align_corners=False
+    )
+    # the views stacked along H, one sampling pass without copying the input
+    grid = grid.reshape(1, num_views * height, width, 2)
+    out = F.grid_sample(
+        x,
+        grid.expand(batch_size, -1, -1, -1),
+        mode="bilinear",
+        padding_mode="border",
+        align_corners=False,
+    )
+    out = out.view(batch_size, channels, num_views, height, width).transpose(1, 2)
+    return out.reshape(batch_size * num_views, channels, height, width)